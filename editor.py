@@ -1,30 +1,56 @@
-import io
-import struct
+import hashlib
+import queue
+import threading
 import typing
+from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from typing import Any, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import pygubu
 import nlzss11
 
+from lib.byteorder import ByteOrder
 from lib.darc import Darc
 from lib.lms import LMSProjectFile, LMSStandardFile, LMSFlowFile, TXT2Block, HashTableBlock
-from lib.oms import OMSProject
+from lib.oms import OMSProject, OMSText
 
 PROJECT_PATH = Path(__file__).parent
 PROJECT_UI = PROJECT_PATH / "editor.ui"
 
 
 def clear_tree(tree: ttk.Treeview) -> None:
-    for i in tree.get_children():
-        tree.delete(i)
+    tree.delete(*tree.get_children())
 
 
 def clear_text(text: tk.Text) -> None:
-    if len(text.get("1.0", tk.END)) > 0:
-        text.delete("1.0", tk.END)
+    text.delete("1.0", tk.END)
+
+
+@contextmanager
+def batch_update(tree: ttk.Treeview) -> Iterator[None]:
+    # unmap the tree while bulk inserting so tk only lays it out once at the end
+    manager = tree.winfo_manager()
+    layout = {}
+    if manager == "pack":
+        layout = tree.pack_info()
+        tree.pack_forget()
+    elif manager == "grid":
+        tree.grid_remove()
+
+    display_columns = tree["displaycolumns"]
+    tree.configure(displaycolumns=())
+    try:
+        yield
+    finally:
+        tree.configure(displaycolumns=display_columns)
+        if manager == "pack":
+            tree.pack(**layout)
+        elif manager == "grid":
+            tree.grid()
+        tree.update_idletasks()
 
 
 class EditorApp:
@@ -37,6 +63,12 @@ class EditorApp:
     msg_tag_tree: ttk.Treeview
 
     open_prj: Optional[OMSProject]
+    _pending_children: Dict[str, Callable[[], None]]
+    _msbt_cache: Dict[bytes, Tuple[LMSStandardFile, List[str]]]
+    _tag_rows: Dict[Tuple[str, str], List[Tuple[int, str, str]]]
+    _shown_message: Optional[Tuple[str, str]]
+    _iid_to_msg: Dict[str, Tuple[str, str]]
+    _archive_results: "queue.Queue[Tuple[Callable[..., None], Tuple[Any, ...]]]"
 
     def __init__(self) -> None:
         self.builder = builder = pygubu.Builder()
@@ -56,6 +88,7 @@ class EditorApp:
 
         self.file_tree = builder.get_object("file_tree")
         # self.file_tree.bind("<1>", self.callback_tree_select)
+        self.file_tree.bind("<<TreeviewOpen>>", self.callback_tree_open)
         
         self.text_pane = builder.get_object("text_editor_text")
         self.text_tab = builder.get_object("text_editor_tab")
@@ -65,6 +98,13 @@ class EditorApp:
         self.msbp_tree = builder.get_object("project_tree")
 
         self.open_prj = None
+        self.files = {}
+        self._pending_children = {}
+        self._msbt_cache = {}
+        self._tag_rows = {}
+        self._shown_message = None
+        self._iid_to_msg = {}
+        self._archive_results = queue.Queue()
 
     def run(self) -> None:
         self.main_window.mainloop()
@@ -76,116 +116,187 @@ class EditorApp:
         self.open_file(f)
 
     def open_file(self, f) -> None:
-        filebytes = f.read()
+        # read and unpacked off the ui thread, the result is queued and picked up by _drain_archive
         name = Path(f.name).name
+        threading.Thread(target=self._read_archive, args=(f, name), daemon=True).start()
+        self.main_window.after(50, self._drain_archive)
+
+    def _drain_archive(self) -> None:
+        try:
+            callback, args = self._archive_results.get_nowait()
+        except queue.Empty:
+            self.main_window.after(50, self._drain_archive)
+            return
+        callback(*args)
+
+    def _read_archive(self, f, name: str) -> None:
+        with f:
+            filebytes = memoryview(f.read())
 
-        if filebytes[0] == 0x11:
+        if len(filebytes) and filebytes[0] == 0x11:
             try:
                 print("decompressing lz11")
-                filebytes = nlzss11.decompress(filebytes)
+                filebytes = memoryview(nlzss11.decompress(filebytes))
             except Exception as e:
-                messagebox.showerror("Error opening file", str(e))
-                exit(1)
+                self._archive_results.put((self._open_failed, (str(e),)))
+                return
 
-        if bytes(filebytes[0:4]) != b"darc":
+        if filebytes[:4] != b"darc":
             print("darc file")
-            messagebox.showerror("Error opening file", "Invalid DARC file magic")
-            exit(1)
+            self._archive_results.put((self._open_failed, ("Invalid DARC file magic",)))
+            return
 
-        self.open_arc = arc = Darc.from_bytes(filebytes)
+        try:
+            arc = Darc.from_bytes(filebytes)
+        except Exception as e:
+            self._archive_results.put((self._open_failed, (str(e),)))
+            return
+
+        self._archive_results.put((self._show_archive, (name, arc)))
+
+    def _open_failed(self, message: str) -> None:
+        messagebox.showerror("Error opening file", message)
+        exit(1)
+
+    def _show_archive(self, name: str, arc: Darc) -> None:
+        self.open_arc = arc
 
         print(arc)
 
         container_id = "/"
-        self.file_tree.insert("", "end", iid=container_id, text=name)
-
-        files = {}
-        dirs = []
-        for entry in arc.entries():
-            if entry.is_dir:
-                dirs.append(entry.filepath)
-            else:
-                files[entry.filepath] = entry.data
-
-        for d in dirs:
-            if d:
-                self.file_tree.insert("/", "end", iid=d, text=d)
-
-        print(files.keys())
-
-        for file in files.keys():
-            parent = "/"
-            key = file
-            if len(file.split("/")) > 2:
-                parent = "/" + file.split("/")[1]
-                file = "/" + file.split("/")[2]
-            self.file_tree.insert(parent, "end", iid=key, text=file)
 
         self.files = {}
-        for file, data in files.items():
-            if file.endswith(".msbt"):
-                self.files[file] = LMSStandardFile.from_bytes(data)
 
-        for file, msbt in self.files.items():
-            txt2: TXT2Block = msbt.blocks["TXT2"]
+        with batch_update(self.file_tree):
+            self.file_tree.insert("", "end", iid=container_id, text=name)
+
+            for entry in arc.entries():
+                key = entry.filepath
+                if entry.is_dir:
+                    if key:
+                        self.file_tree.insert("/", "end", iid=key, text=key)
+                    continue
+
+                parent = "/"
+                text = key
+                parts = key.split("/", 3)
+                if len(parts) > 2:
+                    parent = "/" + parts[1]
+                    text = "/" + parts[2]
+                self.file_tree.insert(parent, "end", iid=key, text=text)
+
+                if key.endswith(".msbt"):
+                    self._defer_children(key, partial(self._populate_msbt, key, entry.data))
+
+    def _defer_children(self, iid: str, populate: Callable[[], None]) -> None:
+        # children are only built when the node is first expanded
+        self.file_tree.insert(iid, "end", iid=f"{iid}!__placeholder__", text="...")
+        self._pending_children[iid] = populate
+
+    def _parse_msbt(self, data: bytes) -> Tuple[LMSStandardFile, List[str]]:
+        # keyed by content so reopening the same archive skips the parse
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        if key not in self._msbt_cache:
+            msbt = LMSStandardFile.from_bytes(data)
+
             lbl1: HashTableBlock = msbt.blocks["LBL1"]
-            lbl1_idx = {v: k for k, v in lbl1.labels.items()}
-            for i, entry in enumerate(txt2.messages):
-                self.file_tree.insert(file, "end", iid=f"{file}!str_{i}", text=lbl1_idx[i])
+            txt2: TXT2Block = msbt.blocks["TXT2"]
+            lbl1_idx = lbl1.id_to_label(len(txt2.messages))
+
+            self._msbt_cache[key] = (msbt, lbl1_idx)
+        return self._msbt_cache[key]
+
+    def _populate_msbt(self, file: str, data: bytes) -> None:
+        try:
+            msbt, lbl1_idx = self._parse_msbt(data)
+        except Exception as e:
+            self.file_tree.insert(file, "end", iid=f"{file}!__error__", text=f"Error: {e}")
+            return
+        self.files[file] = msbt
+
+        txt2: TXT2Block = msbt.blocks["TXT2"]
+        for i, entry in enumerate(txt2.messages):
+            self.file_tree.insert(file, "end", iid=f"{file}!str_{i}", text=lbl1_idx[i])
+
+    def _populate_messages(self, path: str, text: OMSText) -> None:
+        for i, (lbl, msg) in enumerate(text.messages.items()):
+            iid = f"{path}!str:{lbl}"
+            self._iid_to_msg[iid] = (path, lbl)
+            self.file_tree.insert(path, "end", iid=iid, text=lbl)
+
+    def callback_tree_open(self, event) -> None:
+        iid = self.file_tree.focus()
+        populate = self._pending_children.pop(iid, None)
+        if populate is None:
+            return
+
+        with batch_update(self.file_tree):
+            self.file_tree.delete(f"{iid}!__placeholder__")
+            populate()
 
     def _load_project(self, prj: OMSProject) -> None:
         if self.open_prj is not None:
             raise RuntimeError("Project already loaded")
         self.open_prj = prj
 
-        dirs = []
-        for path, text in prj.messages.items():
-            parts = path.split("/")
-            parent = ""
-            for i in range(1, len(parts) + 1):
-                key = "/".join(parts[0:i]) or "/"
-                if key not in dirs:
-                    dirs.append(key)
-                    self.file_tree.insert(parent, "end", iid=key, text=key.split("/")[-1] or "/")
-                parent = key
-            for i, (lbl, msg) in enumerate(text.messages.items()):
-                self.file_tree.insert(path, "end", iid=f"{path}!str:{lbl}", text=lbl)
+        seen = set()
+        with batch_update(self.file_tree):
+            for path, text in prj.messages.items():
+                parts = path.split("/")
+                parent = ""
+                prefix = parts[0]
+                for i in range(1, len(parts) + 1):
+                    if i > 1:
+                        prefix += "/" + parts[i - 1]
+                    key = prefix or "/"
+                    if key not in seen:
+                        seen.add(key)
+                        self.file_tree.insert(parent, "end", iid=key, text=key.rsplit("/", 1)[-1] or "/")
+                    parent = key
+                self._defer_children(path, partial(self._populate_messages, path, text))
 
     def callback_tree_select(self, event) -> None:
         sel = self.file_tree.selection()[0]
         print(sel)
-        if "!str" not in sel:
+        if sel not in self._iid_to_msg:
             return
 
-        file, str_part = sel.split("!")
-        label = str_part[4:]
+        file, label = self._iid_to_msg[sel]
+
+        # reselecting the message already on screen leaves both panes as they are
+        if self._shown_message == (file, label):
+            return
+        self._shown_message = (file, label)
 
         clear_text(self.text_pane)
         self.text_pane.insert("1.0", self.open_prj.messages[file].messages[label][0])
 
         clear_tree(self.msg_tag_tree)
+        for row in self._message_tag_rows(file, label):
+            self.msg_tag_tree.insert("", "end", iid=str(row[0]), values=row)
+
+    def _message_tag_rows(self, file: str, label: str) -> List[Tuple[int, str, str]]:
+        if (file, label) in self._tag_rows:
+            return self._tag_rows[(file, label)]
+
+        rows = []
         for i, (group, tag, param_data) in enumerate(self.open_prj.messages[file].messages[label][1]):
             param_str = ""
-            param_data_buf = io.BytesIO(param_data)
+            off = 0
             for j, p in enumerate(tag.parameters):
                 param_val = None
 
                 if p.type == 0:
-                    param_val, = struct.unpack("B", param_data_buf.read(1))
+                    param_val = param_data[off]
+                    off += 1
                 elif p.type == 8:
-                    pass
-                    # if len(len_buf := param_data_buf.read(2)) > 0:
-                    #     string_len, = struct.unpack("H", len_buf)
-                    #     param_val = ""
-                    #     for _ in range(string_len):
-                    #         param_val += param_data_buf.read(2).decode("utf-16")
+                    if off + 2 <= len(param_data):
+                        string_len = int.from_bytes(param_data[off:off + 2], "little")
+                        off += 2
+                        param_val = ByteOrder.LITTLE_ENDIAN.decode(param_data[off:off + 2 * string_len])
+                        off += 2 * string_len
                 elif p.type == 9:
-                    param_val = "["
-                    for num, name_index in enumerate(p.items):
-                        if num > 0:
-                            param_val += ", "
-                        param_val += f"\"{self.open_prj.tag_lists[name_index]}\""
-                    param_val += "]"
+                    param_val = "[" + ", ".join(f"\"{self.open_prj.tag_lists[x]}\"" for x in p.items) + "]"
 
 
                 if j > 0:
@@ -193,8 +304,10 @@ class EditorApp:
                 param_str += f"{p.name}={param_val}"
 
 
-            self.msg_tag_tree.insert("", "end", iid=str(i), values=(i, f"{group.name}::{tag.name}", param_str))
+            rows.append((i, f"{group.name}::{tag.name}", param_str))
 
+        self._tag_rows[(file, label)] = rows
+        return rows
 
     def callback_menu_import(self) -> None:
         f = filedialog.askopenfile(mode="rb", filetypes=[("Binary Projects", "*.*")])
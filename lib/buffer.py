@@ -1,5 +1,19 @@
 import io
 import struct
+import sys
+
+from lib.byteorder import ByteOrder, ByteOrderType
+
+_NATIVE = ByteOrder.LITTLE_ENDIAN if sys.byteorder == "little" else ByteOrder.BIG_ENDIAN
+_PREFIX_ORDER = {"<": ByteOrder.LITTLE_ENDIAN, ">": ByteOrder.BIG_ENDIAN, "!": ByteOrder.BIG_ENDIAN, "=": _NATIVE, "@": _NATIVE}
+
+
+def compile_struct(fmt: str) -> struct.Struct:
+    # the format's byte order prefix picks the ByteOrderType that compiles it
+    order: ByteOrderType = _PREFIX_ORDER.get(fmt[:1])
+    if order is None:
+        return _NATIVE.compile(fmt)
+    return order.compile(fmt[1:])
 
 
 class ByteBuffer(io.BytesIO):
@@ -11,44 +25,45 @@ class ByteBuffer(io.BytesIO):
             raise NotImplementedError
 
         if isinstance(val, int):
-            lastpos = self.tell()
-            self.seek(val)
-            b = self.read(1)
-            self.seek(lastpos)
-            return b
+            return self.read(1, val)
 
         raise TypeError(f"{type(self).__name__} indices must be int or slice, got {type(val).__name__}")
 
     def write(self, val, at=None) -> int:
-        lastpos = self.tell()
-        if at is not None:
-            self.seek(at)
+        if at is None:
+            return super().write(val)
 
+        lastpos = self.tell()
+        self.seek(at)
         ret = super().write(val)
-
-        if at is not None:
-            self.seek(lastpos)
-
+        self.seek(lastpos)
         return ret
 
     def read(self, size=None, at=None) -> bytes:
-        lastpos = self.tell()
-        if at is not None:
-            self.seek(at)
+        size = size if size else 1
+        if at is None:
+            return super().read(size)
 
-        ret = super().read(size if size else 1)
-
-        if at is not None:
-            self.seek(lastpos)
-
-        return ret
+        # slice the underlying buffer directly, the view has to be released
+        # before the next write or BytesIO refuses to resize
+        with self.getbuffer() as view:
+            if size < 0:
+                return bytes(view[at:])
+            return bytes(view[at:at + size])
 
     def end(self) -> int:
         self.seek(0, io.SEEK_END)
         return self.tell()
 
     def write_struct(self, val, fmt, at=None) -> int:
-        return self.write(struct.pack(fmt, val), at)
+        s = compile_struct(fmt)
+        if at is not None:
+            # overwrite in place when the region already exists
+            with self.getbuffer() as view:
+                if at + s.size <= len(view):
+                    s.pack_into(view, at, val)
+                    return s.size
+        return self.write(s.pack(val), at)
 
     def write_u8(self, val, at=None) -> int:
         return self.write_struct(val, "<B", at)
@@ -66,28 +81,26 @@ class ByteBuffer(io.BytesIO):
         return self.write(val.encode("ascii") + b"\0", at)
 
     def write_uleb128(self, val) -> int:
-        bits = [c for c in bin(val)[2:]]
-        pad = len(bits) % 7
-        if pad != 0:
-            padding = ['0' for i in range(7-pad)]
-            padding.extend(bits)
-            bits = padding
-        chunks = [bits[i:i+7] for i in range(0, len(bits), 7)]
-        output = []
-        for i, chunk in enumerate(chunks):
-            prefix = "0b1"
-            if i == 0:
-                prefix = "0b0"
-            output.append(int(prefix + "".join(chunk), 2))
-
-        count = 0
-        for byte in output:
-            count += self.write_u8(byte)
-        return count
+        if val < 0x80:
+            return self.write_u8(val)
+
+        # 7 bit groups, most significant group first and unflagged,
+        # every following group gets the high bit set
+        out = bytearray()
+        while val:
+            out.append((val & 0x7F) | 0x80)
+            val >>= 7
+        out[-1] &= 0x7F
+        out.reverse()
+        return self.write(bytes(out))
 
     def read_struct(self, fmt, at=None):
-        n = struct.calcsize(fmt)
-        return struct.unpack(fmt, self.read(n, at))
+        s = compile_struct(fmt)
+        if at is None:
+            return s.unpack(self.read(s.size))
+
+        with self.getbuffer() as view:
+            return s.unpack_from(view, at)
 
     def read_wchar16le(self, at=None):
         return self.read(2, at).decode("utf-16le")
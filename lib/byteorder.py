@@ -1,5 +1,5 @@
 import struct
-from typing import NamedTuple, Any, Optional
+from typing import NamedTuple, Any, Optional, Dict
 
 
 class ByteOrderType:
@@ -7,18 +7,29 @@ class ByteOrderType:
     wchar: str
     bom: bytes
     suffix: str
+    int_order: str
+    _structs: Dict[str, struct.Struct]
 
     def __init__(self, struct_fmt: str, wchar: str, bom: bytes, suffix: str) -> None:
         self.struct = struct_fmt
         self.wchar = wchar
         self.bom = bom
         self.suffix = suffix
+        # spelling int.from_bytes/int.to_bytes take
+        self.int_order = "little" if struct_fmt == "<" else "big"
+        self._structs = {}
+
+    def compile(self, fmt: str) -> struct.Struct:
+        s = self._structs.get(fmt)
+        if s is None:
+            s = self._structs[fmt] = struct.Struct(self.struct + fmt)
+        return s
 
     def pack(self, fmt: str, *args: Any) -> bytes:
-        return struct.pack(self.struct + fmt, *args)
+        return self.compile(fmt).pack(*args)
 
     def unpack(self, fmt: str, buffer: bytes) -> tuple:
-        return struct.unpack(self.struct + fmt, buffer)
+        return self.compile(fmt).unpack(buffer)
 
     def encode(self, string: str) -> bytes:
         return string.encode(self.wchar)
@@ -33,10 +44,15 @@ class ByteOrder:
 
     @staticmethod
     def from_bom(bom: bytes, default: Optional[ByteOrderType] = None) -> ByteOrderType:
-        if bom == b"\xFF\xFE":
-            return ByteOrder.LITTLE_ENDIAN
-        if bom == b"\xFE\xFF":
-            return ByteOrder.BIG_ENDIAN
+        byte_order = _BOM_MAP.get(bom)
+        if byte_order is not None:
+            return byte_order
         if default:
             return default
         raise ValueError("Invalid BOM, or no default specified")
+
+
+_BOM_MAP: Dict[bytes, ByteOrderType] = {
+    ByteOrder.LITTLE_ENDIAN.bom: ByteOrder.LITTLE_ENDIAN,
+    ByteOrder.BIG_ENDIAN.bom: ByteOrder.BIG_ENDIAN,
+}
@@ -1,29 +1,85 @@
+import array
 import io
 import os
 import struct
-from typing import NamedTuple, List, Optional, Generator, Any
-from collections import namedtuple
+import sys
+import typing
+from typing import NamedTuple, List, Optional, Generator, Any, Dict, Union
 
 from lib.byteorder import ByteOrder
 
+_NATIVE_ORDER = "<" if sys.byteorder == "little" else ">"
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
 # darc format reference:
 #   http://web.archive.org/web/20211123124701/http://problemkaputt.de/gbatek-3ds-files-archive-darc.htm
 
 
+def _wstr_end(data: bytes, offset: int) -> int:
+    # the terminator has to sit on a character boundary, skip zero pairs straddling two characters
+    end = data.find(b"\x00\x00", offset)
+    while end != -1 and (end - offset) % 2:
+        end = data.find(b"\x00\x00", end + 1)
+    if end == -1:
+        end = len(data)
+    return end
+
+
+def read_wstr(data: bytes, offset: int, encoding: str) -> str:
+    return data[offset:_wstr_end(data, offset)].decode(encoding)
+
+
+def align(value: int, alignment: int) -> int:
+    m = alignment - 1
+    if alignment & m == 0:
+        return (value + m) & ~m
+    return (value + m) // alignment * alignment
+
+
+def split_wstrs(data: bytes, encoding: str) -> Dict[int, str]:
+    # every null terminated string in a packed table, keyed by its offset
+    strings = {}
+    start = 0
+
+    # with only BMP characters every character is one code unit, so offsets are twice the position
+    try:
+        text = data.decode(encoding)
+    except UnicodeDecodeError:
+        text = None
+    if text is not None and 2 * len(text) == len(data):
+        for string in text.split("\0"):
+            if start >= len(data):
+                break
+            strings[start] = string
+            start += 2 * len(string) + 2
+        return strings
+
+    while start < len(data):
+        end = _wstr_end(data, start)
+        strings[start] = data[start:end].decode(encoding)
+        start = end + 2
+    return strings
+
+
 class DarcEntry:
-    name: str
+    __slots__ = ("_name", "_is_dir", "_children", "_data", "_parent", "_path")
+
+    _name: str
     _is_dir: bool
     _children: List["DarcEntry"]
-    _data: Optional[bytes]
+    _data: Optional[BytesLike]
     _parent: Optional["DarcEntry"]
+    _path: Optional[str]
 
     def __init__(self, name: str, is_dir: bool = False) -> None:
-        self.name = name
+        self._name = name
         self._is_dir = is_dir
 
         self._children = []
         self._data = None
         self._parent = None
+        self._path = None
 
     def __repr__(self) -> str:
         return f"<DarcEntry '{self.name}' {'directory' if self._is_dir else 'file'} length={self.length}>"
@@ -34,6 +90,15 @@ class DarcEntry:
             for e in self._children:
                 e.dump(depth + 1)
 
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @name.setter
+    def name(self, name: str) -> None:
+        self._name = name
+        self._invalidate_path()
+
     @property
     def length(self) -> int:
         if self._is_dir:
@@ -44,13 +109,13 @@ class DarcEntry:
             return 0
 
     @property
-    def data(self) -> bytes:
+    def data(self) -> BytesLike:
         if self._is_dir:
             raise TypeError("Cannot get data of a directory")
         return self._data or bytes()
 
     @data.setter
-    def data(self, data: bytes) -> None:
+    def data(self, data: BytesLike) -> None:
         if self._is_dir:
             raise TypeError("Cannot set data of a directory")
         self._data = data
@@ -59,46 +124,58 @@ class DarcEntry:
         if not self._is_dir:
             raise TypeError("Cannot add children of a file")
         child._parent = self
+        child._invalidate_path()
         self._children.append(child)
 
     def remove_child(self, child: "DarcEntry") -> None:
         if not self._is_dir:
             raise TypeError("Cannot remove children of a file")
         child._parent = None
+        child._invalidate_path()
         self._children.remove(child)
 
+    def _invalidate_path(self) -> None:
+        # a cached path implies a cached parent path, so an uncached node has no cached descendants
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node._path is None:
+                continue
+            node._path = None
+            stack.extend(node._children)
+
     @property
     def filepath(self) -> str:
-        stack = []
-        node: Optional[DarcEntry] = self
-        while node is not None:
-            stack.append(node.name)
-            node = node._parent
-        stack.reverse()
-        return "/".join(stack)
+        if self._path is None:
+            if self._parent is None:
+                self._path = self._name
+            else:
+                self._path = self._parent.filepath + "/" + self._name
+        return self._path
 
     def flat_tree(self) -> Generator["DarcEntry", None, None]:
-        yield self
-        if self._is_dir:
-            for node in self._children:
-                yield from node.flat_tree()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node._is_dir:
+                stack.extend(reversed(node._children))
 
     def breadth_tree(self) -> Generator["DarcEntry", None, None]:
-        if self._is_dir:
-            for node in self._children:
-                if node._is_dir:
-                    yield from node.breadth_tree()
-            for node in self._children:
-                if not node._is_dir:
-                    yield from node.breadth_tree()
-        yield self
+        # each directory comes after its subdirectories and then its files
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded or not node._is_dir:
+                yield node
+                continue
+            stack.append((node, True))
+            stack.extend((child, True) for child in reversed(node._children) if not child._is_dir)
+            stack.extend((child, False) for child in reversed(node._children) if child._is_dir)
 
     def dir_entry_size(self) -> int:
-        i = 1
-        if self._is_dir:
-            for node in self._children:
-                i += node.dir_entry_size()
-        return i
+        # entries in this subtree, itself included
+        return sum(1 for _ in self.flat_tree())
 
     @property
     def is_dir(self) -> bool:
@@ -121,11 +198,13 @@ class DarcEntry:
         if not isinstance(other, DarcEntry):
             return False
 
+        # cheap fields first, the subtree is only walked downwards: comparing parents here
+        # would compare their children, which includes these two entries again
         return \
             self._is_dir == other._is_dir and \
-            self.name == other.name and \
+            self._name == other._name and \
+            len(self._children) == len(other._children) and \
             self._data == other._data and \
-            self._parent == other._parent and \
             self._children == other._children
 
 
@@ -137,104 +216,104 @@ class Darc:
     HEADER_STRUCT = "H I I I I I"  # endian dependant fields
     FILE_TABLE_ENTRY = "I I I"
 
+    FILE_ALIGNMENT = 0x20  # same for every file, there is no per-type table
+
     def __init__(self, byte_order=ByteOrder.LITTLE_ENDIAN) -> None:
         self.byte_order = byte_order
         self._root_entry = DarcEntry("", is_dir=True)
 
     def to_bytes(self) -> bytes:
         buf = io.BytesIO()
+        self.write(buf)
+        return buf.getvalue()
 
-        # write ident magic
-        buf.write(Darc.DARC_MAGIC)
-        buf.write(self.byte_order.bom)
+    def write(self, buf: typing.BinaryIO) -> int:
+        # offsets are relative to where buf starts
+        entries = list(self._root_entry.flat_tree())
 
-        # write header
-        buf.write(self.byte_order.pack(
-            Darc.HEADER_STRUCT,
-            0x1C,               # header length
-            Darc.DARC_VERSION,  # version
-            0xFFFFFFFF,         # file length
-            0x1C,               # file table offset
-            0xFFFFFFFF,         # file table length
-            0xFFFFFFFF,         # file data offset
-        ))
+        table = array.array("I", bytes(12 * len(entries)))
 
-        name_table = io.BytesIO()
-        filename_to_index = {None: 0, self._root_entry.filepath: 0}
-        i = 0
-        for e in self._root_entry.flat_tree():
-            name_offset = name_table.tell()
-            name_table.write(e.name.encode(self.byte_order.wchar))
-            name_table.write(b"\x00\x00")
+        # keyed by id() since entries define __eq__ and are unhashable
+        subtree_size = {}
+        for e in reversed(entries):
+            subtree_size[id(e)] = 1 + sum(subtree_size[id(c)] for c in e._children) if e.is_dir else 1
 
-            buf.write(self.byte_order.pack(
-                Darc.FILE_TABLE_ENTRY,
-                name_offset | (0x01000000 if e.is_dir else 0),
-                filename_to_index[e.parent.filepath if e.parent else None] if e.is_dir else 0,
-                i + e.dir_entry_size() if e.is_dir else e.length,
-            ))
+        wchar = self.byte_order.wchar
+        names = []
+        name_offset = 0
+        filename_to_index = {id(self._root_entry): 0}
+        for i, e in enumerate(entries):
+            name = e.name.encode(wchar) + b"\x00\x00"
+            names.append(name)
 
-            filename_to_index[e.filepath] = i
+            if e.is_dir:
+                parent = e.parent
+                table[3*i] = name_offset | 0x01000000
+                table[3*i + 1] = filename_to_index[id(parent) if parent else id(e)]
+                table[3*i + 2] = i + subtree_size[id(e)]
+            else:
+                table[3*i] = name_offset
 
-            i += 1
+            filename_to_index[id(e)] = i
+            name_offset += len(name)
 
-        # write out name table at end of file headers
-        buf.write(name_table.getvalue())
-
-        name_table_end = buf.tell()
-        file_table_length = name_table_end - 0x1C
-        buf.seek(0x14, os.SEEK_SET)
-        buf.write(self.byte_order.pack("I", file_table_length))
-        buf.seek(name_table_end, os.SEEK_SET)
-
-        def align(b: io.BytesIO):
-            pos = b.tell()
-            extra = pos % 0x20
-            if extra > 0:
-                b.write(b"\x00"*(0x20 - extra))
-
-        align(buf)
-        file_data_start = buf.tell()
-        buf.seek(0x18, os.SEEK_SET)
-        buf.write(self.byte_order.pack("I", file_data_start))
-        buf.seek(file_data_start, os.SEEK_SET)
+        file_table_length = 12 * len(entries) + name_offset
+        file_data_start = align(0x1C + file_table_length, Darc.FILE_ALIGNMENT)
 
+        files = []
+        cursor = file_data_start
         for e in self._root_entry.breadth_tree():
             if e.is_dir:
                 continue
 
-            align(buf)
-            file_pos = buf.tell()
-            buf.write(e.data)
-            file_end = buf.tell()
+            file_pos = align(cursor, Darc.FILE_ALIGNMENT)
+            length = e.length
+            files.append((e, file_pos, length))
 
-            # seek to file table
-            buf.seek(0x1C, os.SEEK_SET)
-            # entry of this file
-            buf.seek(0xC * filename_to_index[e.filepath], os.SEEK_CUR)
-            # first u32 is name offset
-            buf.seek(0x4, os.SEEK_CUR)
-            # write entry data
-            buf.write(self.byte_order.pack("I", file_pos))
-            buf.write(self.byte_order.pack("I", e.length))
+            # skip the name offset, fill in data offset and length
+            i = filename_to_index[id(e)]
+            table[3*i + 1] = file_pos
+            table[3*i + 2] = length
+            cursor = file_pos + length
+        file_size = cursor
+
+        if self.byte_order.struct != _NATIVE_ORDER:
+            table.byteswap()
+
+        # write ident magic
+        buf.write(Darc.DARC_MAGIC)
+        buf.write(self.byte_order.bom)
 
-            # seek back
-            buf.seek(file_end, os.SEEK_SET)
+        # write header
+        buf.write(self.byte_order.compile(Darc.HEADER_STRUCT).pack(
+            0x1C,               # header length
+            Darc.DARC_VERSION,  # version
+            file_size,          # file length
+            0x1C,               # file table offset
+            file_table_length,  # file table length
+            file_data_start,    # file data offset
+        ))
 
-            i += 1
+        buf.write(memoryview(table).cast("B"))
+        # write out name table at end of file headers
+        buf.write(b"".join(names))
 
-        buf.seek(0, os.SEEK_END)
-        file_size = buf.tell()
-        buf.seek(0xC, os.SEEK_SET)
-        buf.write(self.byte_order.pack("I", file_size))
+        cursor = 0x1C + file_table_length
+        for e, file_pos, length in files:
+            if file_pos > cursor:
+                buf.write(bytes(file_pos - cursor))
+            buf.write(e.data)
+            cursor = file_pos + length
+        if file_data_start > cursor:
+            buf.write(bytes(file_data_start - cursor))
 
-        return buf.getvalue()
+        return file_size
 
     @staticmethod
     def from_bytes(data: bytes) -> "Darc":
-        f = io.BytesIO(data)
+        view = memoryview(data)
 
-        magic, bom = struct.unpack(Darc.IDENT_STRUCT, f.read(6))
+        magic, bom = struct.unpack_from(Darc.IDENT_STRUCT, view, 0)
         if magic != Darc.DARC_MAGIC:
             raise TypeError(f"Invalid magic: expected {Darc.DARC_MAGIC!r} got {magic!r}")
 
@@ -247,47 +326,51 @@ class Darc:
             print("Warning: Darc file has invalid endian marker (defaulting to little endian)")
 
         header_len, version, file_size, file_tab_off, file_tab_len, file_dat_off = \
-            byte_order.unpack(Darc.HEADER_STRUCT, f.read(22))
+            byte_order.compile(Darc.HEADER_STRUCT).unpack_from(view, 6)
 
         if version != Darc.DARC_VERSION:
             raise TypeError(f"Unsupported version: expected {hex(Darc.DARC_VERSION)} got {hex(version)}")
 
+        entry_struct = byte_order.compile(Darc.FILE_TABLE_ENTRY)
+
         # read root entry
-        _, _, end_index = byte_order.unpack(Darc.FILE_TABLE_ENTRY, f.read(12))
+        _, _, end_index = entry_struct.unpack_from(view, 0x1C)
         root = DarcEntry("", is_dir=True)
 
-        raw_file_table = []
-        for _ in range(end_index - 1):
-            raw_file_table.append(byte_order.unpack(Darc.FILE_TABLE_ENTRY, f.read(12)))
-
-        name_table_start = f.tell()
-
-        # dir, end
-        StackItem = namedtuple("StackItem", "node end")
-        directory_stack = [StackItem(root, end_index)]
+        # rows after the root entry
+        table_start = 0x1C + entry_struct.size
+        name_table_start = 0x1C + entry_struct.size * end_index
+        raw_file_table = entry_struct.iter_unpack(view[table_start:name_table_start])
+        name_table = bytes(view[name_table_start:file_tab_off + file_tab_len])
+        wchar = byte_order.wchar
+        names = split_wstrs(name_table, wchar)
+
+        # (dir, end) of the enclosing directories, the innermost one is kept in locals
+        directory_stack = []
+        parent, parent_end = root, end_index
         for i, (name_offset, file_offset, length) in enumerate(raw_file_table):
-            if directory_stack[-1].end == i:
-                # at end index
-                directory_stack.pop()
+            while parent_end == i:
+                # at end index, nested directories can all close on the same entry
+                parent, parent_end = directory_stack.pop()
 
             is_dir = (name_offset & 0x01000000) != 0
             name_offset &= ~0x01000000
 
-            name = ""
-            f.seek(name_table_start + name_offset, os.SEEK_SET)
-            while (ch := f.read(2)) != b"\x00\x00":
-                name += ch.decode(byte_order.wchar)
+            name = names.get(name_offset)
+            if name is None:
+                # offset points into the middle of another name
+                name = read_wstr(name_table, name_offset, wchar)
 
             entry = DarcEntry(name, is_dir)
-            directory_stack[-1].node.add_child(entry)
+            parent.add_child(entry)
 
             # length is end index for directory or file size for file
             if not is_dir:
-                # read file content
-                f.seek(file_offset, os.SEEK_SET)
-                entry.data = f.read(length)
+                # file content is a view into the archive
+                entry.data = view[file_offset:file_offset + length]
             else:
-                directory_stack.append(StackItem(entry, length - 1))
+                directory_stack.append((parent, parent_end))
+                parent, parent_end = entry, length - 1
 
         arc = Darc(byte_order)
         arc._root_entry = root
@@ -305,11 +388,9 @@ class Darc:
 
         node = None
         if split[0] == "":
-            split.pop(0)
             node = self._root_entry
 
-        while split and node:
-            dir_name = split.pop(0)
+        for dir_name in split[1:] if node else ():
             for c in node.children:
                 if c.is_dir and c.name == dir_name:
                     node = c
@@ -1,4 +1,5 @@
 import enum
+from typing import Dict
 
 
 class FileType(enum.Enum):
@@ -11,14 +12,18 @@ class FileType(enum.Enum):
 
     @staticmethod
     def guess(data: bytes) -> "FileType":
+        if not data:
+            return FileType.UNKNOWN_FILE
         if data[0] == 0x11:
             return FileType.LZ11_FILE
-        if data[0:4] == b"darc":
-            return FileType.DARC_FILE
-        if data[0:8] == b"MsgStdBn":
-            return FileType.MSBT_FILE
-        if data[0:8] == b"MsgPrjBn":
-            return FileType.MSBP_FILE
-        if data[0:8] == b"MsgFlwBn":
-            return FileType.MSBF_FILE
-        return FileType.UNKNOWN_FILE
+
+        head = bytes(data[0:8])
+        return _MAGICS.get(head) or _MAGICS.get(head[0:4], FileType.UNKNOWN_FILE)
+
+
+_MAGICS: Dict[bytes, FileType] = {
+    b"darc": FileType.DARC_FILE,
+    b"MsgStdBn": FileType.MSBT_FILE,
+    b"MsgPrjBn": FileType.MSBP_FILE,
+    b"MsgFlwBn": FileType.MSBF_FILE,
+}
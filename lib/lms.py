@@ -1,11 +1,12 @@
 from abc import ABC, abstractmethod
-import os
+import array
+import functools
+import re
 import struct
-import io
-import typing
-from typing import Dict, Type, List, Any, Tuple
-
-import hexdump
+import itertools
+import operator
+import sys
+from typing import Dict, Type, List, Any, Tuple, Union
 
 from lib.byteorder import ByteOrder, ByteOrderType
 
@@ -15,33 +16,82 @@ from lib.byteorder import ByteOrder, ByteOrderType
 # ￼
 
 
-def read_char(f: typing.BinaryIO, encoding: str) -> str:
-    width = len("A".encode(encoding))
-    return f.read(width).decode(encoding)
+BlockData = Union[bytes, memoryview]
+
+
+CHAR_WIDTHS: Dict[str, int] = {
+    "utf-8": 1,
+    "utf-16-le": 2,
+    "utf-16-be": 2,
+    "utf-32-le": 4,
+    "utf-32-be": 4,
+}
+
+
+def char_width(encoding: str) -> int:
+    width = CHAR_WIDTHS.get(encoding)
+    if width is None:
+        width = CHAR_WIDTHS[encoding] = len("A".encode(encoding))
+    return width
+
 
+# wider characters step whole code units so a zero run straddling two characters isn't taken as the end
+_CSTR_TERMINATORS: Dict[int, "re.Pattern[bytes]"] = {
+    1: re.compile(b"\x00"),
+    2: re.compile(b"(?s:..)*?\x00\x00"),
+    4: re.compile(b"(?s:....)*?\x00\x00\x00\x00"),
+}
 
-def read_str(f: typing.BinaryIO, encoding: str, length: int = -1) -> str:
-    if length == -1:
-        s = ""
-        while (c := read_char(f, encoding)) != "\0":
-            s += c
-        return s
+
+def cstr_end(data: BlockData, offset: int, width: int) -> int:
+    if width == 1:
+        m = _CSTR_TERMINATORS[1].search(data, offset)
     else:
-        width = len("A".encode(encoding))
-        return f.read(length * width).decode(encoding)
+        m = _CSTR_TERMINATORS[width].match(data, offset)
+    if m is None:
+        return len(data)
+    return m.end() - width
+
+
+def read_cstr(data: BlockData, offset: int, encoding: str) -> str:
+    return str(data[offset:cstr_end(data, offset, char_width(encoding))], encoding)
+
+
+def unpack_array(data: BlockData, offset: int, count: int, fmt: str, byte_order: ByteOrderType) -> Tuple[Any, ...]:
+    return struct.unpack_from(f"{byte_order.struct}{count}{fmt}", data, offset)
+
 
+def offset_table(data: BlockData, byte_order: ByteOrderType, count_fmt: str = "I", base: int = 0) -> Tuple[int, ...]:
+    # the count (padded to 4 bytes when it's a u16) followed by that many u32 offsets
+    count, = byte_order.compile(count_fmt).unpack_from(data, base)
+    return unpack_array(data, base + 4, count, "I", byte_order)
 
-def align_buf(f: typing.BinaryIO, n: int, fill: bytes = b"\x00") -> int:
-    remain = f.tell() % n
-    if remain > 0:
-        return f.write(fill * (n - remain))
-    return 0
+
+def pack_offset_table(bodies: List[bytes], byte_order: ByteOrderType, count_fmt: str = "I") -> bytes:
+    # the writing side of offset_table, the bodies follow the table in order
+    offsets = []
+    pos = 4 + 4 * len(bodies)
+    for body in bodies:
+        offsets.append(pos)
+        pos += len(body)
+    count = byte_order.compile(count_fmt).pack(len(bodies)).ljust(4, b"\x00")
+    return count + struct.pack(f"{byte_order.struct}{len(offsets)}I", *offsets) + b"".join(bodies)
+
+
+def pack_indexed_name(indexes: List[int], name: str, encoding: str, byte_order: ByteOrderType) -> bytes:
+    # TGG2 and TAG2 entries: a u16 count, that many u16 indexes and the name, padded to 4 bytes
+    body = struct.pack(f"{byte_order.struct}H{len(indexes)}H", len(indexes), *indexes) + name.encode(encoding) + b"\x00"
+    return body + bytes(-len(body) & 3)
+
+
+def pack_records(records: List[Tuple[Any, ...]], fmt: str, byte_order: ByteOrderType) -> bytes:
+    return struct.pack(f"{byte_order.struct}I{fmt * len(records)}", len(records), *itertools.chain.from_iterable(records))
 
 
 class LMSBlock(ABC):
     @staticmethod
     @abstractmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "LMSBlock":
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "LMSBlock":
         raise NotImplementedError
 
     @abstractmethod
@@ -55,9 +105,9 @@ class UnknownBlock(LMSBlock):
         self.data = bytes()
 
     @staticmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "UnknownBlock":
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "UnknownBlock":
         block = UnknownBlock()
-        block.data = data
+        block.data = bytes(data)
         return block
 
     def to_bytes(self) -> bytes:
@@ -73,64 +123,75 @@ class HashTableBlock(LMSBlock):
         self.byte_order = byte_order
 
     @staticmethod
+    @functools.lru_cache(maxsize=1 << 14)
     def hash(label: str, num_slots: int) -> int:
+        # labels are stored as utf-8, so hash those bytes (same as ord() for ascii labels)
         val = 0
-        for c in label:
-            val = val * 0x492 + ord(c)
-        return (val & 0xFFFFFFFF) % num_slots
+        for c in label.encode("utf-8"):
+            val = (val * 0x492 + c) & 0xFFFFFFFF
+        return val % num_slots
 
     @staticmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "HashTableBlock":
-        f = io.BytesIO(data)
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "HashTableBlock":
+        view = memoryview(data)
         byte_order = lms_file.byte_order
 
-        num_slots, = byte_order.unpack("I", f.read(4))
+        unpack_u32 = byte_order.compile("I").unpack_from
+        slot_struct = byte_order.compile("I I")
+
+        num_slots = int.from_bytes(view[0:4], byte_order.int_order)
 
         labels = {}
-        for _ in range(num_slots):
-            num_labels, labels_offset = byte_order.unpack("I I", f.read(8))
-
-            pos = f.tell()
-            if num_labels:
-                f.seek(labels_offset, os.SEEK_SET)
-                for _ in range(num_labels):
-                    label_len, = byte_order.unpack("B", f.read(1))
-                    label = ""
-                    for _ in range(label_len):
-                        label += read_char(f, "utf-8")
-                    item, = byte_order.unpack("I", f.read(4))
-                    labels[label] = item
-                f.seek(pos, os.SEEK_SET)
+        for num_labels, off in slot_struct.iter_unpack(view[4:4 + num_slots * 8]):
+            for _ in range(num_labels):
+                label_len = view[off]
+                label = str(view[off + 1:off + 1 + label_len], "utf-8")
+                off += 1 + label_len
+                item, = unpack_u32(view, off)
+                off += 4
+                labels[label] = item
 
         tab = HashTableBlock(num_slots, byte_order)
         tab.labels = labels
         return tab
 
     def to_bytes(self) -> bytes:
-        f = io.BytesIO()
-
-        f.write(self.byte_order.pack("I", self.num_slots))
-
-        slots = {x: [] for x in range(self.num_slots)}
-        for lbl, value in self.labels.items():
-            slots[HashTableBlock.hash(lbl, self.num_slots)].append((lbl, value))
-
-        slots_start = f.tell()
-        f.write(b"\x00" * self.num_slots * 8)
-
-        for hash_val, labels in slots.items():
-            pos = f.tell()
-            for lbl, val in labels:
-                f.write(self.byte_order.pack("B", len(lbl)))
-                f.write(lbl.encode("utf-8"))
-                f.write(self.byte_order.pack("I", val))
-            end = f.tell()
-
-            f.seek(slots_start + (hash_val * 8), os.SEEK_SET)
-            f.write(self.byte_order.pack("I I", len(labels), pos))
-            f.seek(end, os.SEEK_SET)
-
-        return f.getvalue()
+        # sorted by slot, the sort is stable so a slot keeps insertion order
+        hashed = sorted(
+            ((HashTableBlock.hash(lbl, self.num_slots), lbl.encode("utf-8"), value) for lbl, value in self.labels.items()),
+            key=operator.itemgetter(0),
+        )
+
+        u32 = self.byte_order.compile("I")
+
+        # (label count, labels offset) word pairs per slot
+        table = array.array("I", bytes(8 * self.num_slots))
+        entries = []
+        pos = 4 + 8 * self.num_slots
+        next_slot = 0
+        for hash_val, labels in itertools.groupby(hashed, key=operator.itemgetter(0)):
+            table[2 * next_slot + 1:2 * hash_val + 1:2] = array.array("I", [pos]) * (hash_val - next_slot)
+            table[2 * hash_val + 1] = pos
+            for _, lbl, val in labels:
+                entries.append(bytes((len(lbl),)) + lbl + u32.pack(val))
+                pos += len(lbl) + 5
+                table[2 * hash_val] += 1
+            next_slot = hash_val + 1
+        table[2 * next_slot + 1::2] = array.array("I", [pos]) * (self.num_slots - next_slot)
+
+        if self.byte_order.int_order != sys.byteorder:
+            table.byteswap()
+        return u32.pack(self.num_slots) + table.tobytes() + b"".join(entries)
+
+    def id_to_label(self, count: int) -> List[str]:
+        # ids are dense, so the inverse of labels for ids 0..count-1 is just a list
+        inverse = [None] * count
+        for label, item in self.labels.items():
+            if item < count:
+                inverse[item] = label
+        if None in inverse:
+            raise ValueError(f"No label for index {inverse.index(None)}")
+        return inverse
 
     def __repr__(self) -> str:
         return f"<HashTableBlock slots={self.num_slots} labels={self.labels!r}>"
@@ -149,13 +210,10 @@ class CLR1Block(LMSBlock):
         return f"<CLR1Block colors={self.colors!r}>"
 
     @staticmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "CLR1Block":
-        f = io.BytesIO(data)
-
-        colors = []
-        num_colors, = lms_file.byte_order.unpack("I", f.read(4))
-        for _ in range(num_colors):
-            colors.append(lms_file.byte_order.unpack(CLR1Block.COLOR_STRUCT, f.read(4)))
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "CLR1Block":
+        num_colors = int.from_bytes(data[0:4], lms_file.byte_order.int_order)
+        color_struct = lms_file.byte_order.compile(CLR1Block.COLOR_STRUCT)
+        colors = list(color_struct.iter_unpack(data[4:4 + num_colors * color_struct.size]))
 
         blk = CLR1Block()
         blk.colors = colors
@@ -163,13 +221,7 @@ class CLR1Block(LMSBlock):
         return blk
 
     def to_bytes(self) -> bytes:
-        f = io.BytesIO()
-
-        f.write(self.byte_order.pack("I", len(self.colors)))
-        for c in self.colors:
-            f.write(self.byte_order.pack(CLR1Block.COLOR_STRUCT, *c))
-
-        return f.getvalue()
+        return pack_records(self.colors, CLR1Block.COLOR_STRUCT, self.byte_order)
 
 
 class ATI2Block(LMSBlock):
@@ -183,13 +235,10 @@ class ATI2Block(LMSBlock):
         return f"<ATI2Block attributes={self.attributes!r}>"
 
     @staticmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "ATI2Block":
-        f = io.BytesIO(data)
-
-        attrs = []
-        num_attrs, = lms_file.byte_order.unpack("I", f.read(4))
-        for _ in range(num_attrs):
-            attrs.append(lms_file.byte_order.unpack(ATI2Block.ATTR_STRUCT, f.read(8)))
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "ATI2Block":
+        num_attrs = int.from_bytes(data[0:4], lms_file.byte_order.int_order)
+        attr_struct = lms_file.byte_order.compile(ATI2Block.ATTR_STRUCT)
+        attrs = list(attr_struct.iter_unpack(data[4:4 + num_attrs * attr_struct.size]))
 
         blk = ATI2Block()
         blk.attributes = attrs
@@ -197,13 +246,7 @@ class ATI2Block(LMSBlock):
         return blk
 
     def to_bytes(self) -> bytes:
-        f = io.BytesIO()
-
-        f.write(self.byte_order.pack("I", len(self.attributes)))
-        for a in self.attributes:
-            f.write(self.byte_order.pack(ATI2Block.ATTR_STRUCT, *a))
-
-        return f.getvalue()
+        return pack_records(self.attributes, ATI2Block.ATTR_STRUCT, self.byte_order)
 
 
 class ALI2Block(LMSBlock):
@@ -216,31 +259,18 @@ class ALI2Block(LMSBlock):
         return f"<ALI2Block lists={self.lists!r}>"
 
     @staticmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "ALI2Block":
-        f = io.BytesIO(data)
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "ALI2Block":
+        encoding = lms_file.encoding
+        byte_order = lms_file.byte_order
 
         lists = []
-        num_lists, = lms_file.byte_order.unpack("I", f.read(4))
-        for _ in range(num_lists):
-            offset, = lms_file.byte_order.unpack("I", f.read(4))
-            pos = f.tell()
-            f.seek(offset, os.SEEK_SET)
-
-            names = []
-            list_base = f.tell()
-            list_items, = lms_file.byte_order.unpack("I", f.read(4))
-            for _ in range(list_items):
-                name_offset, = lms_file.byte_order.unpack("I", f.read(4))
-                pos2 = f.tell()
-
-                f.seek(list_base + name_offset, os.SEEK_SET)
-                name = read_str(f, lms_file.encoding)
-
-                names.append(name)
-                f.seek(pos2, os.SEEK_SET)
-
+        for list_base in offset_table(data, byte_order):
+            # each list is a table of its own, offsets relative to where it starts
+            names = [
+                read_cstr(data, list_base + name_offset, encoding)
+                for name_offset in offset_table(data, byte_order, base=list_base)
+            ]
             lists.append(names)
-            f.seek(pos, os.SEEK_SET)
 
         blk = ALI2Block()
         blk.byte_order = lms_file.byte_order
@@ -249,37 +279,12 @@ class ALI2Block(LMSBlock):
         return blk
 
     def to_bytes(self) -> bytes:
-        f = io.BytesIO()
-
-        f.write(self.byte_order.pack("I", len(self.lists)))
-        f.write(b"\x00" * 4 * len(self.lists))
-
-        for list_idx, l in enumerate(self.lists):
-            list_pos = f.tell()
-            f.seek(4 * (list_idx + 1), os.SEEK_SET)
-            f.write(self.byte_order.pack("I", list_pos))
-            f.seek(list_pos, os.SEEK_SET)
-
-            list_base = f.tell()
-            f.write(self.byte_order.pack("I", len(l)))
-            f.write(b"\x00" * 4 * len(l))
-
-            for string_idx, string in enumerate(l):
-                string_pos = f.tell()
-                f.write(string.encode(self.encoding))
-                f.write(b"\x00")
-
-                after = f.tell()
-
-                f.seek(list_base + (4 * (string_idx + 1)), os.SEEK_SET)
-                f.write(self.byte_order.pack("I", string_pos - list_base))
-                f.seek(after, os.SEEK_SET)
-
-            remain = f.tell() % 4
-            if remain > 0:
-                f.write(b"\x00" * (4 - remain))
-
-        return f.getvalue()
+        # each list is a table of its own, padded so the next one starts on a 4 byte boundary
+        lists = []
+        for l in self.lists:
+            body = pack_offset_table([string.encode(self.encoding) + b"\x00" for string in l], self.byte_order)
+            lists.append(body + bytes(-len(body) & 3))
+        return pack_offset_table(lists, self.byte_order)
 
 
 class TGG2Block(LMSBlock):
@@ -294,23 +299,18 @@ class TGG2Block(LMSBlock):
         return f"<TGG2Block groups={self.groups!r}>"
 
     @staticmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "TGG2Block":
-        f = io.BytesIO(data)
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "TGG2Block":
+        encoding = lms_file.encoding
+        byte_order = lms_file.byte_order
+        u16 = byte_order.compile("H")
 
         groups = []
-        num_groups, = lms_file.byte_order.unpack("H 2x", f.read(4))
-        for _ in range(num_groups):
-            offset, = lms_file.byte_order.unpack("I", f.read(4))
-            pos = f.tell()
-            f.seek(offset, os.SEEK_SET)
-            num_tags, = lms_file.byte_order.unpack("H", f.read(2))
-            tag_indexes = []
-            for _ in range(num_tags):
-                i, = lms_file.byte_order.unpack("H", f.read(2))
-                tag_indexes.append(i)
-            name = read_str(f, lms_file.encoding)
+        for offset in offset_table(data, byte_order, "H"):
+            num_tags, = u16.unpack_from(data, offset)
+            end = offset + 2 + 2 * num_tags
+            tag_indexes = list(unpack_array(data, offset + 2, num_tags, "H", byte_order))
+            name = read_cstr(data, end, encoding)
             groups.append((name, tag_indexes))
-            f.seek(pos, os.SEEK_SET)
 
         blk = TGG2Block()
         blk.byte_order = lms_file.byte_order
@@ -319,25 +319,8 @@ class TGG2Block(LMSBlock):
         return blk
 
     def to_bytes(self) -> bytes:
-        f = io.BytesIO()
-
-        f.write(self.byte_order.pack("H 2x", len(self.groups)))
-        f.write(b"\x00" * 4 * len(self.groups))
-
-        for i, (group, tags) in enumerate(self.groups):
-            group_pos = f.tell()
-            f.seek(4 * (i + 1), os.SEEK_SET)
-            f.write(self.byte_order.pack("I", group_pos))
-            f.seek(group_pos, os.SEEK_SET)
-
-            f.write(self.byte_order.pack("H", len(tags)))
-            for x in tags:
-                f.write(self.byte_order.pack("H", x))
-            f.write(group.encode(self.encoding))
-            f.write(b"\x00")
-            align_buf(f, 4)
-
-        return f.getvalue()
+        bodies = [pack_indexed_name(tags, group, self.encoding, self.byte_order) for group, tags in self.groups]
+        return pack_offset_table(bodies, self.byte_order, "H")
 
 
 class TAG2Block(LMSBlock):
@@ -352,23 +335,18 @@ class TAG2Block(LMSBlock):
         return f"<TAG2Block tags={self.tags!r}>"
 
     @staticmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "TAG2Block":
-        f = io.BytesIO(data)
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "TAG2Block":
+        encoding = lms_file.encoding
+        byte_order = lms_file.byte_order
+        u16 = byte_order.compile("H")
 
         tags = []
-        num_tags, = lms_file.byte_order.unpack("H 2x", f.read(4))
-        for _ in range(num_tags):
-            offset, = lms_file.byte_order.unpack("I", f.read(4))
-            pos = f.tell()
-            f.seek(offset, os.SEEK_SET)
-            num_params, = lms_file.byte_order.unpack("H", f.read(2))
-            param_indexes = []
-            for _ in range(num_params):
-                i, = lms_file.byte_order.unpack("H", f.read(2))
-                param_indexes.append(i)
-            name = read_str(f, lms_file.encoding)
+        for offset in offset_table(data, byte_order, "H"):
+            num_params, = u16.unpack_from(data, offset)
+            end = offset + 2 + 2 * num_params
+            param_indexes = list(unpack_array(data, offset + 2, num_params, "H", byte_order))
+            name = read_cstr(data, end, encoding)
             tags.append((name, param_indexes))
-            f.seek(pos, os.SEEK_SET)
 
         blk = TAG2Block()
         blk.byte_order = lms_file.byte_order
@@ -377,25 +355,8 @@ class TAG2Block(LMSBlock):
         return blk
 
     def to_bytes(self) -> bytes:
-        f = io.BytesIO()
-
-        f.write(self.byte_order.pack("H 2x", len(self.tags)))
-        f.write(b"\x00" * 4 * len(self.tags))
-
-        for i, (tag, params) in enumerate(self.tags):
-            group_pos = f.tell()
-            f.seek(4 * (i + 1), os.SEEK_SET)
-            f.write(self.byte_order.pack("I", group_pos))
-            f.seek(group_pos, os.SEEK_SET)
-
-            f.write(self.byte_order.pack("H", len(params)))
-            for x in params:
-                f.write(self.byte_order.pack("H", x))
-            f.write(tag.encode(self.encoding))
-            f.write(b"\x00")
-            align_buf(f, 4)
-
-        return f.getvalue()
+        bodies = [pack_indexed_name(params, tag, self.encoding, self.byte_order) for tag, params in self.tags]
+        return pack_offset_table(bodies, self.byte_order, "H")
 
 
 class TGP2Block(LMSBlock):
@@ -410,32 +371,25 @@ class TGP2Block(LMSBlock):
         return f"<TGP2Block parameters={self.parameters!r}>"
 
     @staticmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "TGP2Block":
-        f = io.BytesIO(data)
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "TGP2Block":
+        encoding = lms_file.encoding
+        byte_order = lms_file.byte_order
+        u16 = byte_order.compile("H")
 
         params = []
-        num_params, = lms_file.byte_order.unpack("H 2x", f.read(4))
-        for _ in range(num_params):
-            offset, = lms_file.byte_order.unpack("I", f.read(4))
-            pos = f.tell()
-            f.seek(offset, os.SEEK_SET)
-
-            param_type, = lms_file.byte_order.unpack("B", f.read(1))
+        for offset in offset_table(data, byte_order, "H"):
+            param_type = data[offset]
 
             if param_type != 9:
-                name = read_str(f, lms_file.encoding)
+                name = read_cstr(data, offset + 1, encoding)
                 params.append((name, param_type, []))
             else:
-                num_items, = lms_file.byte_order.unpack("1x H", f.read(3))
-                items = []
-                for _ in range(num_items):
-                    i, = lms_file.byte_order.unpack("H", f.read(2))
-                    items.append(i)
-                name = read_str(f, lms_file.encoding)
+                num_items, = u16.unpack_from(data, offset + 2)
+                end = offset + 4 + 2 * num_items
+                items = list(unpack_array(data, offset + 4, num_items, "H", byte_order))
+                name = read_cstr(data, end, encoding)
                 params.append((name, param_type, items))
 
-            f.seek(pos, os.SEEK_SET)
-
         blk = TGP2Block()
         blk.byte_order = lms_file.byte_order
         blk.encoding = lms_file.encoding
@@ -443,30 +397,15 @@ class TGP2Block(LMSBlock):
         return blk
 
     def to_bytes(self) -> bytes:
-        f = io.BytesIO()
-
-        f.write(self.byte_order.pack("H 2x", len(self.parameters)))
-        f.write(b"\x00" * 4 * len(self.parameters))
-
-        for i, (name, param_type, items) in enumerate(self.parameters):
-            group_pos = f.tell()
-            f.seek(4 * (i + 1), os.SEEK_SET)
-            f.write(self.byte_order.pack("I", group_pos))
-            f.seek(group_pos, os.SEEK_SET)
-
-            f.write(self.byte_order.pack("B", param_type))
+        bodies = []
+        for name, param_type, items in self.parameters:
+            name = name.encode(self.encoding) + b"\x00"
             if param_type != 9:
-                f.write(name.encode(self.encoding))
-                f.write(b"\x00")
+                body = bytes((param_type,)) + name
             else:
-                f.write(self.byte_order.pack("1x H", len(items)))
-                for x in items:
-                    f.write(self.byte_order.pack("H", x))
-                f.write(name.encode(self.encoding))
-                f.write(b"\x00")
-            align_buf(f, 4)
-
-        return f.getvalue()
+                body = struct.pack(f"{self.byte_order.struct}B x H {len(items)}H", param_type, len(items), *items) + name
+            bodies.append(body + bytes(-len(body) & 3))
+        return pack_offset_table(bodies, self.byte_order, "H")
 
 
 class TGL2Block(LMSBlock):
@@ -479,18 +418,9 @@ class TGL2Block(LMSBlock):
         return f"<TGL2Block names={self.names!r}>"
 
     @staticmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "TGL2Block":
-        f = io.BytesIO(data)
-
-        names = []
-        items, = lms_file.byte_order.unpack("H 2x", f.read(4))
-        for _ in range(items):
-            offset, = lms_file.byte_order.unpack("I", f.read(4))
-            pos = f.tell()
-            f.seek(offset, os.SEEK_SET)
-            name = read_str(f, lms_file.encoding)
-            names.append(name)
-            f.seek(pos, os.SEEK_SET)
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "TGL2Block":
+        encoding = lms_file.encoding
+        names = [read_cstr(data, offset, encoding) for offset in offset_table(data, lms_file.byte_order, "H")]
 
         blk = TGL2Block()
         blk.byte_order = lms_file.byte_order
@@ -499,22 +429,7 @@ class TGL2Block(LMSBlock):
         return blk
 
     def to_bytes(self) -> bytes:
-        f = io.BytesIO()
-
-        f.write(self.byte_order.pack("H 2x", len(self.names)))
-
-        # reserve space for offsets
-        f.write(b"\x00" * 4 * len(self.names))
-
-        for i, name in enumerate(self.names):
-            pos = f.tell()
-            f.seek(4 + (4 * i), os.SEEK_SET)
-            f.write(self.byte_order.pack("I", pos))
-            f.seek(pos, os.SEEK_SET)
-            f.write(name.encode(self.encoding))
-            f.write(b"\x00")
-
-        return f.getvalue()
+        return pack_offset_table([name.encode(self.encoding) + b"\x00" for name in self.names], self.byte_order, "H")
 
 
 class SYL3Block(LMSBlock):
@@ -528,13 +443,10 @@ class SYL3Block(LMSBlock):
         return f"<SYL3Block styles={self.styles!r}>"
 
     @staticmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "SYL3Block":
-        f = io.BytesIO(data)
-
-        styles = []
-        num, = lms_file.byte_order.unpack("I", f.read(4))
-        for _ in range(num):
-            styles.append(lms_file.byte_order.unpack(SYL3Block.STYLE_STRUCT, f.read(16)))
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "SYL3Block":
+        num = int.from_bytes(data[0:4], lms_file.byte_order.int_order)
+        style_struct = lms_file.byte_order.compile(SYL3Block.STYLE_STRUCT)
+        styles = list(style_struct.iter_unpack(data[4:4 + num * style_struct.size]))
 
         blk = SYL3Block()
         blk.byte_order = lms_file.byte_order
@@ -542,13 +454,7 @@ class SYL3Block(LMSBlock):
         return blk
 
     def to_bytes(self) -> bytes:
-        f = io.BytesIO()
-
-        f.write(self.byte_order.pack("I", len(self.styles)))
-        for a in self.styles:
-            f.write(self.byte_order.pack(SYL3Block.STYLE_STRUCT, *a))
-
-        return f.getvalue()
+        return pack_records(self.styles, SYL3Block.STYLE_STRUCT, self.byte_order)
 
 
 class CTI1Block(LMSBlock):
@@ -561,22 +467,9 @@ class CTI1Block(LMSBlock):
         return f"<CTI1Block filenames={self.filenames!r}>"
 
     @staticmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "CTI1Block":
-        f = io.BytesIO(data)
-
-        filenames = []
-        num_filenames, = lms_file.byte_order.unpack("I", f.read(4))
-        for _ in range(num_filenames):
-            offset, = lms_file.byte_order.unpack("I", f.read(4))
-            pos = f.tell()
-            name = ""
-            f.seek(offset, os.SEEK_SET)
-
-            while (ch := read_char(f, lms_file.encoding)) != "\0":
-                name += ch
-
-            filenames.append(name)
-            f.seek(pos, os.SEEK_SET)
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "CTI1Block":
+        encoding = lms_file.encoding
+        filenames = [read_cstr(data, offset, encoding) for offset in offset_table(data, lms_file.byte_order)]
 
         blk = CTI1Block()
         blk.byte_order = lms_file.byte_order
@@ -585,22 +478,7 @@ class CTI1Block(LMSBlock):
         return blk
 
     def to_bytes(self) -> bytes:
-        f = io.BytesIO()
-
-        f.write(self.byte_order.pack("I", len(self.filenames)))
-
-        # reserve space for offsets
-        f.write(b"\x00"*4*len(self.filenames))
-
-        for i, name in enumerate(self.filenames):
-            pos = f.tell()
-            f.seek(4 + (4 * i), os.SEEK_SET)
-            f.write(self.byte_order.pack("I", pos))
-            f.seek(pos, os.SEEK_SET)
-            f.write(name.encode(self.encoding))
-            f.write(b"\x00")
-
-        return f.getvalue()
+        return pack_offset_table([name.encode(self.encoding) + b"\x00" for name in self.filenames], self.byte_order)
 # End of MSBP file raw_blocks
 
 
@@ -608,6 +486,8 @@ class CTI1Block(LMSBlock):
 class TXT2Block(LMSBlock):
     messages: List[Tuple[str, List[Tuple[int, int, bytes]]]]
 
+    _SPECIAL_UNITS: Dict[str, "re.Pattern[bytes]"] = {}
+
     def __init__(self, byte_order: ByteOrderType = ByteOrder.LITTLE_ENDIAN, encoding: str = "utf-8") -> None:
         self.byte_order = byte_order
         self.encoding = encoding
@@ -617,42 +497,60 @@ class TXT2Block(LMSBlock):
         return f"<TXT2Block messages={self.messages!r}>"
 
     @staticmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "TXT2Block":
-        f = io.BytesIO(data)
+    def _special_units(encoding: str) -> "re.Pattern[bytes]":
+        # matches from a character boundary up to the next code unit that isn't plain text:
+        # the terminator, a tag start, or (multi byte encodings only) a unit with an E0 byte in it
+        pattern = TXT2Block._SPECIAL_UNITS.get(encoding)
+        if pattern is None:
+            width = char_width(encoding)
+            units = [re.escape("\0".encode(encoding)), re.escape("\x0E".encode(encoding))]
+            if width > 1:
+                units += [b"." * i + b"\xE0" + b"." * (width - i - 1) for i in range(width)]
+            pattern = re.compile(b"(?s)(?:" + b"." * width + b")*?(" + b"|".join(units) + b")")
+            TXT2Block._SPECIAL_UNITS[encoding] = pattern
+        return pattern
 
-        messages = []
-        num_messages, = lms_file.byte_order.unpack("I", f.read(4))
-        for i in range(num_messages):
-            offset, = lms_file.byte_order.unpack("I", f.read(4))
-            pos = f.tell()
-            f.seek(offset, os.SEEK_SET)
+    @staticmethod
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "TXT2Block":
+        encoding = lms_file.encoding
+        width = char_width(encoding)
+        terminator = "\0".encode(encoding)
+        tag_start = "\x0E".encode(encoding)
+        special_units = TXT2Block._special_units(encoding)
+        tag_header = lms_file.byte_order.compile("HHH")
 
-            msg = ""
+        messages = []
+        for pos in offset_table(data, lms_file.byte_order):
+            msg = []
             tags = []
 
-            width = len("A".encode(lms_file.encoding))
-            ch = None
-            while ch != "\0":
-                char_bytes = f.read(width)
-                ch = char_bytes.decode(lms_file.encoding)
+            while m := special_units.match(data, pos):
+                if m.start(1) > pos:
+                    msg.append(str(data[pos:m.start(1)], encoding))
+                unit = m.group(1)
+                pos = m.end()
 
-                if ch == "\0":
+                if unit == terminator:
                     break
 
-                if ch == "\x0E":
-                    tag_group, tag_type, param_size = lms_file.byte_order.unpack("HHH", f.read(6))
-                    param_data = f.read(param_size)
+                if unit == tag_start:
+                    tag_group, tag_type, param_size = tag_header.unpack_from(data, pos)
+                    pos += 6
+                    param_data = bytes(data[pos:pos + param_size])
+                    pos += param_size
                     tags.append((tag_group, tag_type, param_data))
-                    msg += "￼"
-                elif b"\xE0" in char_bytes:
+                    msg.append("￼")
+                else:
                     # seems to be xx E0 for a button label (shorthand?)
-                    button = char_bytes.replace(b"\xE0", b"")
+                    button = unit.replace(b"\xE0", b"")
                     tags.append((-1, -1, button))
-                    msg += "￼"
-                else:
-                    msg += ch
-            messages.append((msg, tags))
-            f.seek(pos, os.SEEK_SET)
+                    msg.append("￼")
+            else:
+                # ran off the end of the block without a terminator
+                end = len(data) - (len(data) - pos) % width
+                if end > pos:
+                    msg.append(str(data[pos:end], encoding))
+            messages.append(("".join(msg), tags))
 
         blk = TXT2Block()
         blk.byte_order = lms_file.byte_order
@@ -696,44 +594,34 @@ class ATR1Block(LMSBlock):
         return f"<ATR1Block attributes={[a[0] for a in self.attributes]!r}>"
 
     @staticmethod
-    def from_bytes(data: bytes, lms_file: "LMSFile") -> "ATR1Block":
-        f = io.BytesIO(data)
+    def from_bytes(data: BlockData, lms_file: "LMSFile") -> "ATR1Block":
+        encoding = lms_file.encoding
+        width = char_width(encoding)
+        u32 = lms_file.byte_order.compile("I")
 
         attrs = []
         strings = []
-        num_attrs, bytes_per_attr = lms_file.byte_order.unpack("I I", f.read(8))
+        num_attrs, bytes_per_attr = lms_file.byte_order.compile("I I").unpack_from(data, 0)
         if bytes_per_attr != 0:
+            pos = 8
             for _ in range(num_attrs):
-                a = f.read(bytes_per_attr)
+                a = bytes(data[pos:pos + bytes_per_attr])
+                pos += bytes_per_attr
 
-                str_off, = lms_file.byte_order.unpack("I", a[4:8])
-                pos = f.tell()
-                f.seek(str_off, os.SEEK_SET)
-                name = read_str(f, lms_file.encoding)
+                str_off, = u32.unpack_from(a, 4)
+                name = read_cstr(data, str_off, encoding)
                 attrs.append((name, a))
-                f.seek(pos, os.SEEK_SET)
-
-            offs = {}
-            if f.tell() < len(data):
-                # print("guessing a string table (prepare for danger)")
-                while f.tell() < len(data):
-                    # print(f"start of string: {f.tell()}")
-                    off = f.tell()
-                    string = read_str(f, lms_file.encoding)
-                    strings.append(string)
-                    offs[off] = string
-
-            for name, attr in attrs:
-                buf = io.BytesIO(attr)
-                # check every int why not
-                for i in range(0, len(attr), 4):
-                    val, = lms_file.byte_order.unpack("I", buf.read(4))
-                    if val in offs:
-                        print(f"possible string: attr offset {hex(i)}={val} => {offs[val]!r}")
+
+            # print("guessing a string table (prepare for danger)")
+            while pos < len(data):
+                # print(f"start of string: {pos}")
+                end = cstr_end(data, pos, width)
+                strings.append(str(data[pos:end], encoding))
+                pos = end + width
 
         blk = ATR1Block()
         blk.byte_order = lms_file.byte_order
-        blk.data = data
+        blk.data = bytes(data)
         blk.attributes = attrs
         blk.strings = strings
         return blk
@@ -750,7 +638,17 @@ class LMSFile:
 
     LMS_VERSION = 0x00000003
 
-    raw_blocks: dict[str, bytes]
+    # (encoding type, byte order suffix) => codec name
+    ENCODINGS: Dict[Tuple[int, str], str] = {
+        (0, "le"): "utf-8",
+        (0, "be"): "utf-8",
+        (1, "le"): "utf-16-le",
+        (1, "be"): "utf-16-be",
+        (2, "le"): "utf-32-le",
+        (2, "be"): "utf-32-be",
+    }
+
+    raw_blocks: dict[str, memoryview]
     blocks: dict[str, LMSBlock]
 
     def __init__(self) -> None:
@@ -761,48 +659,37 @@ class LMSFile:
         self.blocks = {}
 
     def _read_header(self, data: bytes) -> None:
-        f = io.BytesIO(data)
-
-        magic, bom = struct.unpack(LMSFile.LMS_IDENT, f.read(10))
+        magic, bom = struct.unpack_from(LMSFile.LMS_IDENT, data, 0)
         byte_order = ByteOrder.from_bom(bom)
 
-        enc_type, version, num_blocks, filesize = byte_order.unpack(LMSFile.LMS_HEADER, f.read(22))
+        enc_type, version, num_blocks, filesize = byte_order.compile(LMSFile.LMS_HEADER).unpack_from(data, 10)
 
         if version != LMSFile.LMS_VERSION:
             raise ValueError(f"Unsupported LMS file version! expected {hex(LMSFile.LMS_VERSION)} got {hex(version)}")
 
-        if enc_type == 0:
-            encoding = "utf-8"
-        elif enc_type == 1:
-            encoding = "utf-16-" + byte_order.suffix
-        elif enc_type == 2:
-            encoding = "utf-32-" + byte_order.suffix
-        else:
+        encoding = LMSFile.ENCODINGS.get((enc_type, byte_order.suffix))
+        if encoding is None:
             raise ValueError(f"Invalid encoding type! expected [0, 1, 2] got {enc_type}")
 
+        view = memoryview(data)
+        blk_header = byte_order.compile(LMSFile.BLK_HEADER)
         blocks = {}
+        off = 0x20
         while len(blocks) < num_blocks:
-            block_type, block_size = byte_order.unpack(LMSFile.BLK_HEADER, f.read(16))
-            block_type = block_type.decode("ascii")
-            block_data = f.read(block_size)
-            blocks[block_type] = block_data
+            block_type, block_size = blk_header.unpack_from(data, off)
+            block_type = _BLOCK_TYPE_NAMES.get(block_type) or block_type.decode("ascii")
+            off += 0x10
+            blocks[block_type] = view[off:off + block_size]
 
-            # align buffer to 0x10 bytes
-            rem = f.tell() % 16
-            if rem > 0:
-                f.seek((16 - rem), os.SEEK_CUR)
+            # blocks start on 0x10 byte boundaries
+            off = (off + block_size + 0xF) & ~0xF
 
         self.magic = magic
         self.byte_order = byte_order
         self.encoding = encoding
         self.raw_blocks = blocks
 
-    def _write_header(self, f: typing.BinaryIO) -> None:
-        # ident
-        f.write(self.magic)
-        f.write(self.byte_order.bom)
-
-        # header data
+    def _write_header(self, filesize: int) -> bytes:
         encoding_num = 0
         if self.encoding == "utf-8":
             encoding_num = 0
@@ -811,63 +698,68 @@ class LMSFile:
         elif self.encoding.startswith("utf-32"):
             encoding_num = 2
 
-        f.write(self.byte_order.pack(
+        # ident + header data
+        return self.magic + self.byte_order.bom + self.byte_order.pack(
             LMSFile.LMS_HEADER,
             encoding_num,
             LMSFile.LMS_VERSION,
             len(self.blocks),
-            0,  # fill in filesize later
-        ))
+            filesize,
+        )
 
     def _parse_blocks(self, types: Dict[str, Type[LMSBlock]], debug: bool = False):
+        debug_raise_errors = False
         unpacked_sections: Dict[str, LMSBlock] = {}
         for block_type, data in self.raw_blocks.items():
-            if block_type not in types:
+            block_class = types.get(block_type)
+            if block_class is None:
                 raise RuntimeError(f"Unhandled block type: {block_type}")
 
-            unpacked_sections[block_type] = types[block_type].from_bytes(data, self)
-
-            debug_raise_errors = False
-            if debug:
-                # todo debugging
-                try:
-                    new = unpacked_sections[block_type].to_bytes()
-                    assert new == data
-                    print(f"[{'?' if isinstance(unpacked_sections[block_type], UnknownBlock) else '✓'}] {block_type}")
-                except AssertionError:
-                    print(f"[✗] {block_type} (assert failed)")
-                    hexdump.hexdump(new)
-                    print("/\\new   old\\/")
-                    hexdump.hexdump(data)
-                    if debug_raise_errors:
-                        raise
-                except NotImplementedError:
-                    print(f"[✗] {block_type} (not implemented)")
-                    if debug_raise_errors:
-                        raise
+            block = unpacked_sections[block_type] = block_class.from_bytes(data, self)
+            if not debug:
+                continue
+
+            # todo debugging
+            try:
+                new = block.to_bytes()
+                assert new == data
+                print(f"[{'?' if isinstance(block, UnknownBlock) else '✓'}] {block_type}")
+            except AssertionError:
+                import hexdump
+                print(f"[✗] {block_type} (assert failed)")
+                hexdump.hexdump(new)
+                print("/\\new   old\\/")
+                hexdump.hexdump(data)
+                if debug_raise_errors:
+                    raise
+            except NotImplementedError:
+                print(f"[✗] {block_type} (not implemented)")
+                if debug_raise_errors:
+                    raise
         self.blocks = unpacked_sections
 
-    def _write_blocks(self, f: typing.BinaryIO) -> None:
+    def _write_blocks(self) -> List[bytes]:
+        blk_header = self.byte_order.compile(LMSFile.BLK_HEADER)
+        parts = []
         for block_type, block in self.blocks.items():
             block_data = block.to_bytes()
-            f.write(self.byte_order.pack(
-                LMSFile.BLK_HEADER,
+            parts.append(blk_header.pack(
                 block_type.encode("ascii"),
                 len(block_data),
             ))
-            f.write(block_data)
-            align_buf(f, 0x10, b"\xAB")
+            parts.append(block_data)
+            # block headers are 0x10 bytes, so only the data decides the padding
+            parts.append(b"\xAB" * (-len(block_data) & 0xF))
+        return parts
 
     def to_bytes(self) -> bytes:
-        f = io.BytesIO()
-        self._write_header(f)
-        self._write_blocks(f)
-
-        size = f.tell()
-        f.seek(18, os.SEEK_SET)
-        f.write(self.byte_order.pack("I", size))
-
-        return f.getvalue()
+        blocks = self._write_blocks()
+        filesize = (
+            self.byte_order.compile(LMSFile.LMS_IDENT).size
+            + self.byte_order.compile(LMSFile.LMS_HEADER).size
+            + sum(map(len, blocks))
+        )
+        return b"".join([self._write_header(filesize), *blocks])
 
 
 class LMSProjectFile(LMSFile):
@@ -976,3 +868,10 @@ class LMSFlowFile(LMSFile):
         flw._parse_blocks(LMSFlowFile.SECTIONS)
 
         return flw
+
+
+_BLOCK_TYPE_NAMES: Dict[bytes, str] = {
+    name.encode("ascii"): name
+    for file_type in (LMSProjectFile, LMSStandardFile, LMSFlowFile)
+    for name in file_type.SECTIONS
+}
@@ -1,33 +1,117 @@
+import logging
+import re
 import struct
 import io
 import typing
 
-from hexdump import hexdump
-
 from lib.buffer import ByteBuffer
+from lib.byteorder import ByteOrder
+from lib.darc import align
+
+
+log = logging.getLogger(__name__)
 
 
 class MsbtFormatException(Exception):
     pass
 
 
+# the legacy parser only handles little endian files
+_LE = ByteOrder.LITTLE_ENDIAN
+
+# the padding pair only counts on a character boundary
+_TXT2_END = re.compile(b"(?s:..)*?\xAB\xAB")
+
+
+# control sequence handlers, (subtype, extra) => (replacement text or None if unrecognised, description)
+def _ctrl_text_block(ctrl_subtype: int, extra: bytes) -> typing.Tuple[typing.Optional[str], str]:
+    if extra == b"\x00\x00\x00\xFF":
+        return "{END_TEXT}", "end text block"
+    return f"{{BEGIN_TEXT attrs=[{extra.hex(' ')}]}}", "begin text block"
+
+
+def _ctrl_island(ctrl_subtype: int, extra: bytes) -> typing.Tuple[typing.Optional[str], str]:
+    if extra == b"\x00\x00":
+        return "{ISLAND_NAME}", "island name"
+    return None, "unknown (island related?)"
+
+
+def _ctrl_if(ctrl_subtype: int, extra: bytes) -> typing.Tuple[typing.Optional[str], str]:
+    pos = 0
+    cond = bytes()
+    if ctrl_subtype != 0x0001:
+        cond = extra[0:2]
+        pos = 2
+
+    first_len, = _LE.compile("H").unpack_from(extra, pos)
+    first_str = extra[pos + 2:pos + 2 + first_len].decode("utf-16le")
+    pos += 2 + first_len
+
+    second_len, = _LE.compile("H").unpack_from(extra, pos)
+    second_str = extra[pos + 2:pos + 2 + second_len].decode("utf-16le")
+
+    return (
+        f"{{IF cond=[{cond.hex(' ')}] true=[{first_str}] false=[{second_str}]}}",
+        f"if cond={cond.hex(' ')!r} T={first_str!r} F={second_str!r}",
+    )
+
+
+def _ctrl_mii(ctrl_subtype: int, extra: bytes) -> typing.Tuple[typing.Optional[str], str]:
+    if extra == b"\x01\x00\x00\xcd":
+        return "{MII_NAME}", "mii name"
+    return None, "unknown (mii related?)"
+
+
+# (type, subtype) => handler, a subtype of None matches any subtype of that type
+_CTRL_HANDLERS: typing.Dict[typing.Tuple[int, typing.Optional[int]], typing.Callable] = {
+    (0x0000, 0x0003): _ctrl_text_block,
+    (0x0004, 0x000b): _ctrl_island,
+    (0x0008, None): _ctrl_if,
+    (0x0001, 0x0000): _ctrl_mii,
+}
+
+
+# called just past the \x0E, returns (replacement text or None if unrecognised, header, extra)
+def read_control_seq(buf: ByteBuffer) -> typing.Tuple[typing.Optional[str], bytes, bytes]:
+    # account for shifting out control char
+    buf.seek(buf.tell() - 2)
+    header = buf.read(8)
+    ctrl_chr, ctrl_type, ctrl_subtype, extra_len = _LE.compile("HHHH").unpack(header)
+
+    extra = bytes()
+    if extra_len:
+        extra = buf.read(extra_len)
+
+    handler = _CTRL_HANDLERS.get((ctrl_type, ctrl_subtype)) or _CTRL_HANDLERS.get((ctrl_type, None))
+    if handler is None:
+        text, desc = None, "unknown (unknown)"
+    else:
+        text, desc = handler(ctrl_subtype, extra)
+
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("header: [%s] +%d extra => [%s] (%s)", header.hex(' '), extra_len, extra.hex(' '), desc)
+
+    return text, header, extra
+
+
 class Msbt:
-    def __init__(self, buf: typing.BinaryIO, debug=False) -> None:
-        self.debug = debug
-        self.data = buf
+    def __init__(self, buf: typing.BinaryIO) -> None:
+        if isinstance(buf, io.BytesIO):
+            self.data = memoryview(buf.getvalue())
+        else:
+            buf.seek(0)
+            self.data = memoryview(buf.read())
 
         self.lbl1 = {}
-        self.lbl1_indexed = {}
+        self.lbl1_indexed: typing.List[typing.Optional[bytes]] = []
+        # the same labels as lbl1, as (group, index, name) in file order
+        self.lbl1_entries: typing.List[typing.Tuple[int, int, bytes]] = []
         self.atr1 = None
         self.txt2 = []
 
-        # seek to end
-        buf.seek(0, 2)
-        self.buf_len = buf.tell()
-        buf.seek(0)
+        self.buf_len = len(self.data)
 
-        header = self.data.read(0x20)
-        magic, bom, encoding, self.sections, file_size = struct.unpack("8s 2s 2x B x H 2x I 8x", header)
+        magic, bom, encoding, self.sections, file_size = _LE.compile("8s 2s 2x B x H 2x I 10x").unpack_from(self.data, 0)
 
         if magic != b"MsgStdBn":
             raise MsbtFormatException("Invalid magic")
@@ -35,186 +119,121 @@ class Msbt:
         if bom != b"\xFF\xFE" and bom != b"\xFE\xFF":
             raise MsbtFormatException("Invalid endianness")
 
-        fpos = self.data.tell()
+        fpos = 0x20
         while fpos < self.buf_len:
-            section_start = self.data.tell()
-            section_id = self.data.read(4)
+            section_start = fpos
+            section_id = bytes(self.data[section_start:section_start + 4])
             # print(f"section id: {section_id}")
 
-            self.dbg(f"[MSBT]: Found section: {section_id.decode()}")
+            log.debug("[MSBT]: Found section: %s", section_id.decode())
             if section_id == b"LBL1":
-                self._read_lbl1(section_start)
+                fpos = self._read_lbl1(section_start)
             elif section_id == b"ATR1":
-                self._read_atr1(section_start)
+                fpos = self._read_atr1(section_start)
             elif section_id == b"TXT2":
-                self._read_txt2(section_start)
+                fpos = self._read_txt2(section_start)
             else:
-                print(f"unk section: {section_id} at {self.data.tell()}")
-                self.data.seek(0)
-                print(hexdump(self.data))
+                from hexdump import hexdump
+                log.error("unk section: %s at %d", section_id, section_start + 4)
+                log.error("%s", hexdump(bytes(self.data), result="return"))
                 exit()
                 break
 
-            fpos = self.data.tell()
-    
-    def dbg(self, message):
-        if self.debug:
-            print(message)
-
     def __repr__(self) -> str:
         return f"<Msbt filesize={self.buf_len} sections={self.sections}>"
 
-    def _read_lbl1(self, section_start) -> None:
-        size, = struct.unpack("I", self.data.read(4))
-        self.data.seek(8, 1)  # padding
+    def _read_lbl1(self, section_start: int) -> int:
+        size, = _LE.compile("I").unpack_from(self.data, section_start + 4)
 
-        start_of_labels = self.data.tell()
-        num_groups, = struct.unpack("I", self.data.read(4))
+        labels = self.data[section_start + 0x10:section_start + 0x10 + size]
+        num_groups, = _LE.compile("I").unpack_from(labels, 0)
 
-        self.dbg(f"[LBL1]: section has {num_groups} groups")
+        log.debug("[LBL1]: section has %d groups", num_groups)
 
-        groups = []
+        groups = list(_LE.compile("I I").iter_unpack(labels[4:4 + 8 * num_groups]))
         num_strings = 0
-        for i in range(num_groups):
-            num_labels, offset = struct.unpack("I I", self.data.read(8))
+        for i, (num_labels, offset) in enumerate(groups):
             num_strings += num_labels
-            groups.append((i, num_labels, offset))
             self.lbl1[i] = {}
-        
-        self.dbg(f"[LBL1]: section has {num_strings} labels")
 
-        for group_num, num_labels, offset in groups:
-            self.data.seek(start_of_labels + offset)
+        log.debug("[LBL1]: section has %d labels", num_strings)
+
+        # label indexes run 0..num_strings-1
+        lbl1_indexed = self.lbl1_indexed
+        lbl1_indexed.extend([None] * (num_strings - len(lbl1_indexed)))
+
+        lbl1_entries = self.lbl1_entries
+        unpack_u32 = _LE.compile("I").unpack_from
+        for group_num, (num_labels, offset) in enumerate(groups):
             for i in range(num_labels):
-                length, = struct.unpack("B", self.data.read(1))
-                name = self.data.read(length)
-                index, = struct.unpack("I", self.data.read(4))
+                length = labels[offset]
+                name = bytes(labels[offset + 1:offset + 1 + length])
+                index, = unpack_u32(labels, offset + 1 + length)
+                offset += 5 + length
                 self.lbl1[group_num][index] = name
-                self.lbl1_indexed[index] = name
-                self.dbg(f"[LBL1]: string {index} (group {group_num}) = {name}")
+                lbl1_entries.append((group_num, index, name))
+                if index >= len(lbl1_indexed):
+                    lbl1_indexed.extend([None] * (index + 1 - len(lbl1_indexed)))
+                lbl1_indexed[index] = name
+                log.debug("[LBL1]: string %d (group %d) = %s", index, group_num, name)
 
         # correct alignment
-        remainder = self.data.tell() % 16
-        if remainder > 0:
-            self.data.seek(16 - remainder, 1)
-
-    def _read_atr1(self, section_start) -> None:
-        size, = struct.unpack("I 8x", self.data.read(12))
-        num_attributes, attribute_size = struct.unpack("I I", self.data.read(8))
-        self.atr1 = self.data.read(size)
+        return align(section_start + 0x10 + len(labels), 16)
+
+    def _read_atr1(self, section_start: int) -> int:
+        size, = _LE.compile("I").unpack_from(self.data, section_start + 4)
+        num_attributes, attribute_size = _LE.compile("I I").unpack_from(self.data, section_start + 0x10)
+        self.atr1 = bytes(self.data[section_start + 0x18:section_start + 0x18 + size])
         # print(f"size: {size}, num_attributes: {num_attributes}, attribute_size: {attribute_size}")
-        self.data.seek(-8, 1)  # size - 4 bytes, but why?
+
+        # size - 4 bytes past the header, but why?
+        end = min(section_start + 0x18 + size, self.buf_len) - 8
 
         # correct alignment
-        remainder = self.data.tell() % 16
-        if remainder > 0:
-            self.data.seek(16 - remainder, 1)
+        return align(end, 16)
 
-    def _read_txt2(self, section_start) -> None:
-        size, num_entries = struct.unpack("I 8x I", self.data.read(0x10))
-        end_of_header = self.data.tell()
+    def _read_txt2(self, section_start: int) -> int:
+        size, num_entries = _LE.compile("I 8x I").unpack_from(self.data, section_start + 4)
+        end_of_header = section_start + 0x14
         end_of_section = section_start + 0x1E + size
 
-        self.dbg(f"[TXT2] section has {num_entries} text entries")
+        log.debug("[TXT2] section has %d text entries", num_entries)
+
+        entry_offsets = list(struct.unpack_from(f"{_LE.struct}{num_entries}I", self.data, end_of_header))
 
-        entry_offsets = []
-        for i in range(num_entries):
-            off, = struct.unpack("I", self.data.read(4))
-            entry_offsets.append(off)
-        
-        entry = bytearray()
         for i, off in enumerate(entry_offsets):
-            self.data.seek(end_of_header + off - 4)
-            start = self.data.tell()
+            start = end_of_header + off - 4
 
             end = end_of_section
             if i < len(entry_offsets)-1:
                 end = end_of_header + entry_offsets[i+1] - 4
-            
-            self.dbg(f"[TXT2]: entry {i} should be {end - start} bytes long?")
-            
-            # entry = self.data.read(end - start).replace(b"\xAB\xAB", b"")
-            b = None
-            idx = 0
-            while b != b"\xAB\xAB" and idx < (end - start):
-               b = self.data.read(2)
-               idx += 2
-               entry.extend(b)
-            # entry = entry[:-2]
+
+            log.debug("[TXT2]: entry %d should be %d bytes long?", i, end - start)
+
+            # entries are read in whole characters up to and including the first \xAB\xAB pair
+            limit = start + max(end - start + 1, 0) // 2 * 2
+            m = _TXT2_END.match(self.data, start, limit)
+            entry = bytearray(self.data[start:m.end() if m else limit])
             self.txt2.append(entry)
-            # self.dbg(f"[TXT2]: string {i} = {dump(entry)}")
-            entry = bytearray()
-        
+
         # print(f"size: {size}, num_entries: {num_entries}")
-        self.data.seek(section_start + 0x1E + size)
-        
+
         # correct alignment
-        remainder = self.data.tell() % 16
-        if remainder > 0:
-            self.data.seek(16 - remainder, 1)
+        return align(end_of_section, 16)
 
     @staticmethod
-    def from_bytes(data: bytes, debug=False) -> "Msbt":
-        return Msbt(io.BytesIO(data), debug)
+    def from_bytes(data: bytes) -> "Msbt":
+        return Msbt(io.BytesIO(data))
 
     @staticmethod
     def _txt2_handle_control_seq(buf: ByteBuffer) -> str:
-        # account for shifting out control char
-        buf.seek(buf.tell() - 2)
-        header = buf.read(8)
-        ctrl_chr, ctrl_type, ctrl_subtype, extra_len = struct.unpack("HHHH", header)
-
-        extra = bytes()
-        if extra_len:
-            extra = buf.read(extra_len)
-
-        print(f"header: [{header.hex(' ')}] +{extra_len} extra => [{extra.hex(' ')}]", end="")
-
-        if ctrl_type == 0x0000 and ctrl_subtype == 0x0003:
-            if extra == b"\x00\x00\x00\xFF":
-                print(" (end text block)")
-                return "{END_TEXT}"
-            else:
-                print(" (begin text block)")
-                return f"{{BEGIN_TEXT attrs=[{extra.hex(' ')}]}}"
-        elif ctrl_type == 0x0004 and ctrl_subtype == 0x000b:
-            if extra == b"\x00\x00":
-                print(" (island name)")
-                return "{ISLAND_NAME}"
-            else:
-                print(" (unknown (island related?))")
-        elif ctrl_type == 0x0008:  # and ctrl_subtype == 0x0000:
-            extra_buf = ByteBuffer(extra)
-
-            cond = bytes()
-            if ctrl_subtype != 0x0001:
-                cond = extra_buf.read(2)
-
-            first_len = extra_buf.read_u16()
-            first_str = extra_buf.read(first_len).decode("utf-16le")
-
-            second_len = extra_buf.read_u16()
-            second_str = extra_buf.read(second_len).decode("utf-16le")
-
-            print(f" (if cond={cond.hex(' ')!r} T={first_str!r} F={second_str!r})")
-            return f"{{IF cond=[{cond.hex(' ')}] true=[{first_str}] false=[{second_str}]}}"
-        elif ctrl_type == 0x0001 and ctrl_subtype == 0x0000:
-            if extra == b"\x01\x00\x00\xcd":
-                print(" (mii name)")
-                return "{MII_NAME}"
-            else:
-                print(" (unknown (mii related?))")
-        else:
-            print(" (unknown (unknown))")
-
-        return f"{{? [{header.hex(' ')} {extra.hex(' ')}]}}"
+        text, header, extra = read_control_seq(buf)
+        if text is None:
+            return f"{{? [{header.hex(' ')} {extra.hex(' ')}]}}"
+        return text
 
     @staticmethod
-    def decode_txt2_entry(entry: bytes, debug=False) -> str:
-        def dbg(msg) -> None:
-            if debug:
-                print(msg)
-
+    def decode_txt2_entry(entry: bytes) -> str:
         raw_buf = ByteBuffer(entry)
         output_str = ""
         while raw_buf.tell() < len(entry) - 1:
@@ -9,6 +9,8 @@ from lib.lms import LMSProjectFile, LMSStandardFile
 
 
 class TagParameter:
+    __slots__ = ("name", "type", "items")
+
     def __init__(self, name: str, param_type: int, items: List[int]) -> None:
         self.name = name
         self.type = param_type
@@ -19,6 +21,8 @@ class TagParameter:
 
 
 class Tag:
+    __slots__ = ("name", "parameters")
+
     parameters: List[TagParameter]
 
     def __init__(self, name: str, parameters: List[TagParameter]) -> None:
@@ -30,6 +34,8 @@ class Tag:
 
 
 class TagGroup:
+    __slots__ = ("name", "tags")
+
     def __init__(self, name: str, tags: List[Tag]) -> None:
         self.name = name
         self.tags = tags
@@ -45,29 +51,34 @@ class OMSText:
         self.messages = {}
 
     def import_binary_text(self, project: "OMSProject", label: str, message: str, tags: List[Tuple[int, int, bytes]]):
-        text = ""
-        output_index = 0
+        # every tag is one placeholder character
+        parts = message.split("￼")
+        if len(parts) - 1 != len(tags):
+            raise ValueError(f"Message {label!r} has {len(parts) - 1} tag placeholders but {len(tags)} tags")
+        text = [parts[0]]
         output_tags = []
-        for c in message:
-            if c == "￼":
-                group_index, tag_index, param_data = tags.pop(0)
+        for output_index, part in enumerate(parts[1:]):
+            group_index, tag_index, param_data = tags[output_index]
 
+            resolved = project.tag_table.get((group_index, tag_index))
+            if resolved is None:
                 group = project.tag_groups[group_index]
                 tag = group.tags[tag_index]
-
-                output_tags.append((group, tag, param_data))
-                text += "{" + str(output_index) + "}"
-                output_index += 1
             else:
-                text += c
+                group, tag = resolved
+
+            output_tags.append((group, tag, param_data))
+            text.append("{" + str(output_index) + "}")
+            text.append(part)
 
-        self.messages[label] = (text, output_tags)
+        self.messages[label] = ("".join(text), output_tags)
 
 
 class OMSProject:
     tag_parameters: List[TagParameter]
     tags: List[Tag]
     tag_groups: List[TagGroup]
+    tag_table: Dict[Tuple[int, int], Tuple[TagGroup, Tag]]
     messages: Dict[str, OMSText]
     tag_lists = List[str]
 
@@ -75,35 +86,39 @@ class OMSProject:
         self.tag_parameters = []
         self.tags = []
         self.tag_groups = []
+        self.tag_table = {}
         self.messages = {}
         self.tag_lists = []
 
     def import_binary_project(self, data: bytes) -> None:
         file_type = FileType.guess(data)
         if file_type == FileType.LZ11_FILE:
-            data = bytes(nlzss11.decompress(data))
+            data = nlzss11.decompress(data)
             file_type = FileType.guess(data)
 
         if file_type == FileType.DARC_FILE:
             # load the arc
             arc = Darc.from_bytes(data)
 
-            # scan arc for the project data
-            project_bin = None
+            project_entry = None
+            message_files = []
             for e in arc.entries():
-                if not e.is_dir and e.filepath.endswith(".msbp"):
-                    project_bin = LMSProjectFile.from_bytes(e.data)
-                    break
-
-            if not project_bin:
+                if e.is_dir:
+                    continue
+                path = e.filepath
+                if path.endswith(".msbp"):
+                    if project_entry is None:
+                        project_entry = e
+                elif path.endswith(".msbt"):
+                    message_files.append((path, e))
+
+            if project_entry is None:
                 raise TypeError("Darc project container not of expected format (missing msbp file)")
 
-            self._import_msbp(project_bin)
+            self._import_msbp(LMSProjectFile.from_bytes(project_entry.data))
 
-            message_files = []
-            for e in arc.entries():
-                if not e.is_dir and e.filepath.endswith(".msbt"):
-                    self._import_msbt(e.filepath, LMSStandardFile.from_bytes(e.data))
+            for path, e in message_files:
+                self._import_msbt(path, LMSStandardFile.from_bytes(e.data))
 
             print()
 
@@ -126,6 +141,13 @@ class OMSProject:
             groups.append(TagGroup(group_name, [tags[x] for x in group_tags]))
         self.tag_groups = groups
 
+        # (group index, tag index) => (group, tag)
+        self.tag_table = {
+            (group_index, tag_index): (group, tag)
+            for group_index, group in enumerate(groups)
+            for tag_index, tag in enumerate(group.tags)
+        }
+
         lists = []
         for list_name in msbp.tgl2.names:
             lists.append(list_name)
@@ -134,9 +156,8 @@ class OMSProject:
     def _import_msbt(self, path: str, msbt: LMSStandardFile) -> None:
         txt = OMSText()
 
-        id_to_label = {v: k for k, v in msbt.lbl1.labels.items()}
-        for i, (text, tags) in enumerate(msbt.txt2.messages):
-            label = id_to_label[i]
+        labels = msbt.lbl1.id_to_label(len(msbt.txt2.messages))
+        for label, (text, tags) in zip(labels, msbt.txt2.messages):
             txt.import_binary_text(self, label, text, tags)
 
         self.messages[path] = txt
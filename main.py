@@ -1,11 +1,12 @@
-import io
 import os
+import re
 from pathlib import Path
 from typing import Dict
-import struct
 from base64 import b64encode, b64decode
 import argparse
 import enum
+import logging
+from concurrent.futures import ProcessPoolExecutor
 
 import hexdump
 import lxml.etree
@@ -15,7 +16,7 @@ from lxml.etree import _Element as XMLElement
 import nlzss11
 
 from lib.lms import LMSProjectFile, LMSStandardFile, LMSFlowFile
-from lib.msbt import Msbt
+from lib.msbt import Msbt, read_control_seq
 from lib.darc import Darc, DarcEntry
 from lib.buffer import ByteBuffer
 from lib.filetype import FileType
@@ -26,57 +27,20 @@ def replace_extension(file: str, ext: str) -> str:
     return ".".join(file.split(".")[:-1]) + "." + ext
 
 
-def handle_control_seq(buf: ByteBuffer) -> str:
-    # account for shifting out control char
-    buf.seek(buf.tell() - 2)
-    header = buf.read(8)
-    ctrl_chr, ctrl_type, ctrl_subtype, extra_len = struct.unpack("HHHH", header)
+log = logging.getLogger(__name__)
 
-    extra = bytes()
-    if extra_len:
-        extra = buf.read(extra_len)
+# the characters msbt_to_xml has to stop at inside a message: terminator, control sequence, line break
+MSBT_TEXT_SPECIAL = re.compile("[\x00\x0E\n]")
 
-    print(f"header: [{header.hex(' ')}] +{extra_len} extra => [{extra.hex(' ')}]", end="")
+# control characters other than \n can't be stored in xml text, they are swapped for U+FFFD
+CTRL_SCRUB = dict.fromkeys([*range(0, 10), *range(11, 32)], 0xFFFD)
 
-    if ctrl_type == 0x0000 and ctrl_subtype == 0x0003:
-        if extra == b"\x00\x00\x00\xFF":
-            print(" (end text block)")
-            return "{END_TEXT}"
-        else:
-            print(" (begin text block)")
-            return f"{{BEGIN_TEXT attrs=[{extra.hex(' ')}]}}"
-    elif ctrl_type == 0x0004 and ctrl_subtype == 0x000b:
-        if extra == b"\x00\x00":
-            print(" (island name)")
-            return "{ISLAND_NAME}"
-        else:
-            print(" (unknown (island related?))")
-            return "�"
-    elif ctrl_type == 0x0008:# and ctrl_subtype == 0x0000:
-        extra_buf = ByteBuffer(extra)
-
-        cond = bytes()
-        if ctrl_subtype != 0x0001:
-            cond = extra_buf.read(2)
-
-        first_len = extra_buf.read_u16()
-        first_str = extra_buf.read(first_len).decode("utf-16le")
-
-        second_len = extra_buf.read_u16()
-        second_str = extra_buf.read(second_len).decode("utf-16le")
-
-        print(f" (if cond={cond.hex(' ')!r} T={first_str!r} F={second_str!r})")
-        return f"{{IF cond=[{cond.hex(' ')}] true=[{first_str}] false=[{second_str}]}}"
-    elif ctrl_type == 0x0001 and ctrl_subtype == 0x0000:
-        if extra == b"\x01\x00\x00\xcd":
-            print(" (mii name)")
-            return "{MII_NAME}"
-        else:
-            print(" (unknown (mii related?))")
-            return "�"
-    else:
-        print(" (unknown (unknown))")
+
+def handle_control_seq(buf: ByteBuffer) -> str:
+    text, header, extra = read_control_seq(buf)
+    if text is None:
         return "�"
+    return text
 
 
 def msbt_to_xml(msbt: Msbt, path: str) -> XMLElement:
@@ -84,10 +48,8 @@ def msbt_to_xml(msbt: Msbt, path: str) -> XMLElement:
     msbt_node = E("MsbtFile", path=path)
 
     lbl1_node = SE(msbt_node, "Lbl1")
-    for group, group_items in msbt.lbl1.items():
-        for index, label in group_items.items():
-            lbl1_entry_node = SE(lbl1_node, "Label", index=str(index), group=str(group))
-            lbl1_entry_node.text = label.decode()
+    for group, index, label in msbt.lbl1_entries:
+        SE(lbl1_node, "Label", index=str(index), group=str(group)).text = label.decode()
 
     txt2_node = SE(msbt_node, "Txt2")
 
@@ -96,36 +58,47 @@ def msbt_to_xml(msbt: Msbt, path: str) -> XMLElement:
         txt2_entry = SE(txt2_node, "Entry", label=msbt.lbl1_indexed[str_idx])
 
         current_node = txt2_entry
-        current_node.text = ""
-
-        def make_append(node):
-            def append(s):
-                node.text += s
-
-            return append
-        append = make_append(current_node)
-
-        while raw_buf.tell() < len(raw_bytes) - 1:
-            char = raw_buf.read_wchar16le()
-
-            if char == "\x00":
-                break
-            elif char == "\x0E":
-                append(handle_control_seq(raw_buf))
-            elif char == "\n":
-                current_node = SE(current_node, "br")
-                current_node.tail = ""
-
-                def make_append(node):
-                    def append(s):
-                        node.tail += s
-
-                    return append
-                append = make_append(current_node)
+        in_tail = False
+        run = []
+
+        # control sequences carry raw bytes, so decoding starts over after each one
+        pos = 0
+        size = len(raw_bytes)
+        while pos < size - 1:
+            text = raw_bytes[pos:size - (size - pos) % 2].decode("utf-16-le", "surrogatepass")
+            start = 0
+            for m in MSBT_TEXT_SPECIAL.finditer(text):
+                char = m.group()
+                run.append(text[start:m.start()])
+                start = m.end()
+
+                if char == "\x00":
+                    pos = size
+                    break
+                elif char == "\x0E":
+                    raw_buf.seek(pos + len(text[:start].encode("utf-16-le", "surrogatepass")))
+                    run.append(handle_control_seq(raw_buf))
+                    pos = raw_buf.tell()
+                    break
+                else:
+                    if in_tail:
+                        current_node.tail = "".join(run)
+                    else:
+                        current_node.text = "".join(run)
+
+                    current_node = SE(current_node, "br")
+                    in_tail = True
+                    run = []
             else:
-                append(char)
+                run.append(text[start:])
+                pos = size
+
+        if in_tail:
+            current_node.tail = "".join(run)
+        else:
+            current_node.text = "".join(run)
 
-        print(f"string {str_idx} is {txt2_entry.text}")
+        log.debug("string %d is %s", str_idx, txt2_entry.text)
 
     return msbt_node
 
@@ -145,23 +118,23 @@ def darc_to_xml(arc: Darc, compressed: bool = False) -> lxml.etree.ElementBase:
 
     for file, data in files.items():
         if file.endswith(".msbt") and 1 == 2:
-            print(f"processing msbt file !{file}")
+            log.debug("processing msbt file !%s", file)
             m = Msbt.from_bytes(data)
             node = msbt_to_xml(m, file)
             container.append(node)
         elif file.endswith(".msbp"):
-            print(f"processing msbp file !{file}")
+            log.debug("processing msbp file !%s", file)
             p = LMSProjectFile.from_bytes(data)
             exit(1)
         else:
-            print(f"including file !{file} as raw data")
+            log.debug("including file !%s as raw data", file)
             raw_data = SE(container, "RawDataFile", path=file)
             raw_data.text = b64encode(data).decode()
 
     return root
 
 
-def xml_to_darc(root: XMLElement, output: io.BytesIO) -> Darc:
+def xml_to_darc(root: XMLElement) -> Darc:
     arc = Darc()
     for node in root:
         node: XMLElement
@@ -170,7 +143,7 @@ def xml_to_darc(root: XMLElement, output: io.BytesIO) -> Darc:
             file_data = b64decode(node.text)
             arc.add_file(file_path, file_data)
         else:
-            print(f"tag {node.tag} not handled")
+            log.warning("tag %s not handled", node.tag)
 
     return arc
 
@@ -182,18 +155,32 @@ def new_msbt_to_xml(project: LMSProjectFile, msbt: LMSStandardFile, filename: st
     lbl = msbt.lbl1
     txt = msbt.txt2
 
-    id_to_label = {v: k for k, v in lbl.labels.items()}
+    labels = lbl.id_to_label(len(txt.messages))
+    for i, (label, (text, tags)) in enumerate(zip(labels, txt.messages)):
+        scrubbed = text.translate(CTRL_SCRUB)
+        if scrubbed != text:
+            log.warning("Warning: unrepresentable character in stream (msg %d lbl %s txt %r)", i, label, text)
+            text = scrubbed
+
+        if text.count("￼") != len(tags):
+            raise ValueError(f"Message {label!r} has {text.count('￼')} tag placeholders but {len(tags)} tags")
 
-    for i, (text, tags) in enumerate(txt.messages):
-        label = id_to_label[i]
         entry = SE(container, "TextEntry", label=label)
         element = toplevel = SE(entry, "Text")
-        element.text = ""
 
         inline = False
+        run = []
+        tag_idx = 0
         for c in text:
             if c == "￼":
-                tag_group, tag_type, params = tags.pop(0)
+                if not inline:
+                    element.text = "".join(run)
+                else:
+                    element.tail = "".join(run)
+                run = []
+
+                tag_group, tag_type, params = tags[tag_idx]
+                tag_idx += 1
 
                 if tag_group == -1:
                     if tag_type == -1:
@@ -206,16 +193,13 @@ def new_msbt_to_xml(project: LMSProjectFile, msbt: LMSStandardFile, filename: st
 
                 element = SE(toplevel, "Tag", group=group_name, tag=tag_name, params=params.hex(' '))
                 inline = True
-                element.tail = ""
             else:
-                if 0 <= ord(c) <= 9 or 11 <= ord(c) <= 31:
-                    c = "�"
-                    print(f"Warning: unrepresentable character in stream (msg {i} lbl {label} txt {text!r} chr {c!r})")
+                run.append(c)
 
-                if not inline:
-                    element.text += c
-                else:
-                    element.tail += c
+        if not inline:
+            element.text = "".join(run)
+        else:
+            element.tail = "".join(run)
 
     return container
 
@@ -229,11 +213,11 @@ def new_darc_to_xml(arc: Darc, compressed: bool = False) -> XMLElement:
         if not entry.is_dir:
             files[entry.filepath] = entry.data
 
-    print("Looking for project file...")
+    log.info("Looking for project file...")
     project = None
     for file, data in files.items():
         if file.endswith(".msbp"):
-            print(f"Loading project data...")
+            log.info("Loading project data...")
             project = LMSProjectFile.from_bytes(data)
 
     if not project:
@@ -243,12 +227,12 @@ def new_darc_to_xml(arc: Darc, compressed: bool = False) -> XMLElement:
 
     for file, data in files.items():
         if file.endswith(".msbt"):
-            print(f"processing msbt file !{file}")
+            log.debug("processing msbt file !%s", file)
             msg = LMSStandardFile.from_bytes(data)
             node = new_msbt_to_xml(project, msg, file)
             container.append(node)
         else:
-            print(f"including file !{file} as raw data")
+            log.debug("including file !%s as raw data", file)
             raw_data = SE(container, "RawDataFile", path=file)
             raw_data.text = b64encode(data).decode()
 
@@ -273,29 +257,27 @@ def decompile_main(args: argparse.Namespace) -> int:
     was_compressed = False
     if file_type == FileType.LZ11_FILE:
         was_compressed = True
-        in_data = bytes(nlzss11.decompress(in_data))
+        in_data = nlzss11.decompress(in_data)
         file_type = FileType.guess(in_data)
 
     if file_type == FileType.DARC_FILE:
-        print("darc file")
+        log.info("darc file")
         arc = Darc.from_bytes(in_data)
         root = new_darc_to_xml(arc, was_compressed)
 
-        print(f"writing {out_file}")
-        with open(out_file, "wb") as f:
-            f.write(lxml.etree.tostring(root, pretty_print=True, encoding="utf-8"))
+        log.info("writing %s", out_file)
+        lxml.etree.ElementTree(root).write(out_file, pretty_print=True, encoding="utf-8")
         return 0
 
     if file_type == FileType.MSBT_FILE:
-        print("msbt file")
-        msbt = Msbt.from_bytes(in_data, True)
+        log.info("msbt file")
+        msbt = Msbt.from_bytes(in_data)
         root = msbt_to_xml(msbt, in_file.split("/")[-1])
 
-        with open(out_file, "wb") as f:
-            f.write(lxml.etree.tostring(root, pretty_print=True, encoding="utf-8"))
+        lxml.etree.ElementTree(root).write(out_file, pretty_print=True, encoding="utf-8")
         return 0
 
-    print("Unsupported file format")
+    log.error("Unsupported file format")
     return 1
 
 
@@ -303,8 +285,6 @@ def recompile_main(args: argparse.Namespace) -> int:
     in_file = args.input
     out_file = args.output
 
-    output_buffer = io.BytesIO()
-
     with open(in_file, "rb") as f:
         root: XMLElement = lxml.etree.parse(f).getroot()
 
@@ -313,22 +293,25 @@ def recompile_main(args: argparse.Namespace) -> int:
         is_compressed = True
         root = root[0]  # pop off the outer layer and flag for compression later
 
+    if not out_file:
+        out_file = replace_extension(in_file, "new.bin")
+
+    payload = b""
     if root.tag == "DarcContainer":
-        arc = xml_to_darc(root, output_buffer)
-        output_buffer.write(arc.to_bytes())
+        arc = xml_to_darc(root)
+        if not is_compressed:
+            with open(out_file, "wb", buffering=1 << 20) as f:
+                arc.write(f)
+            return 0
+        payload = arc.to_bytes()
 
     # print(lxml.etree.tostring(root))
 
     if is_compressed:
-        compressed_out = io.BytesIO()
-        compressed_out.write(nlzss11.compress(output_buffer.getvalue(), 6))
-        output_buffer = compressed_out
-
-    if not out_file:
-        out_file = replace_extension(in_file, "new.bin")
+        payload = nlzss11.compress(payload, 6)
 
     with open(out_file, "wb") as f:
-        f.write(output_buffer.getvalue())
+        f.write(payload)
 
     return 0
 
@@ -340,6 +323,14 @@ def editor_main(args: argparse.Namespace) -> int:
     return 0
 
 
+def load_archive_files(path: Path) -> Dict[str, bytes]:
+    with open(path, "rb") as file:
+        data = nlzss11.decompress(file.read())
+    arc = Darc.from_bytes(data)
+    # copied out of the archive views so the result can be pickled
+    return {e.filepath: bytes(e.data) for e in arc.entries() if not e.is_dir}
+
+
 def test_main() -> int:
     message_files = []
     messages_path = Path("/home/joseph/Documents/tomodachi_life/romfs/message")
@@ -349,17 +340,13 @@ def test_main() -> int:
 
     unpacked_files = {}
     total = 0
-    for i, f in enumerate(message_files):
-        print(f"\rLoading archive {i+1}/{len(message_files)}", end="", flush=True)
+    with ProcessPoolExecutor() as pool:
+        for i, (f, files) in enumerate(zip(message_files, pool.map(load_archive_files, message_files, chunksize=8))):
+            log.debug("Loading archive %d/%d", i + 1, len(message_files))
 
-        with open(f, "rb") as file:
-            data = nlzss11.decompress(file.read())
-        arc = Darc.from_bytes(data)
-        files = {e.filepath: e.data for e in [e for e in arc.entries() if not e.is_dir]}
-
-        unpacked_files[f] = files
-        total += len(unpacked_files[f])
-    print(f"\nTotal files: {total}")
+            unpacked_files[f] = files
+            total += len(unpacked_files[f])
+    log.info("Total files: %d", total)
 
     exts = {}
     files = {}
@@ -374,23 +361,27 @@ def test_main() -> int:
             exts[ext] += 1
             files[ext].append((file, data))
 
-    print(exts)
+    log.info("%s", exts)
 
+    # every archive carries the same project, identical ones are only parsed once
+    projects: Dict[bytes, LMSProjectFile] = {}
     for file, data in files["msbp"]:
-        print(f"processing msbp file !{file}")
-        p = LMSProjectFile.from_bytes(data)
+        log.info("processing msbp file !%s", file)
+        p = projects.get(data)
+        if p is None:
+            p = projects[data] = LMSProjectFile.from_bytes(data)
         try:
             new = p.to_bytes()
             assert new == data
-            print("[✓] Final MSBP")
+            log.info("[✓] Final MSBP")
         except NotImplementedError:
-            print("[✗] Final MSBP (not implemented)")
+            log.info("[✗] Final MSBP (not implemented)")
         except AssertionError:
-            print("[✗] Final MSBP (assert failed)")
-            hexdump.hexdump(new)
-            print("/\\new   old\\/")
-            hexdump.hexdump(data)
-        print()
+            log.info("[✗] Final MSBP (assert failed)")
+            log.info("%s", hexdump.hexdump(new, result="return"))
+            log.info("/\\new   old\\/")
+            log.info("%s", hexdump.hexdump(data, result="return"))
+        log.info("")
 
     # for file, data in files["msbt"]:
     #     print(f"processing msbt file !{file}")
@@ -435,6 +426,8 @@ def main_args() -> int:
 
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(message)s")
+
     if args.test:
         return test_main()
 